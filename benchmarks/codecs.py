@@ -0,0 +1,52 @@
+# Compares archive codecs on a synthetic executable: compression throughput,
+# decompression time and size.
+#
+#   python -m benchmarks.codecs --size-mb 100 --codecs deflate:9 zstd:19 xz:9
+import argparse
+import pathlib
+import random
+import tempfile
+import time
+from benchmarks.delta_storage import synthetic_exe
+from helpers.codecs import get_codec
+
+
+def main(size_mb, specs, threads, seed):
+    with tempfile.TemporaryDirectory() as tmp:
+        exe_path = pathlib.Path(tmp) / "PathOfExile.exe"
+        exe_path.write_bytes(synthetic_exe(random.Random(seed), size_mb * 1024 * 1024))
+        raw_size = exe_path.stat().st_size
+
+        print(f"{'codec':<12}{'size MB':>10}{'ratio':>8}{'comp s':>9}{'MB/s':>8}{'decomp s':>10}")
+        for spec in specs:
+            name, _, level = spec.partition(":")
+            try:
+                codec = get_codec(name, int(level) if level else None, threads)
+            except ValueError as e:
+                print(f"{spec:<12}skipped: {e}")
+                continue
+
+            archive = exe_path.with_suffix(codec.extension)
+            start = time.perf_counter()
+            size = codec.compress(exe_path, archive, "PathOfExile.exe")
+            compress_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            codec.read(archive, "PathOfExile.exe")
+            decompress_time = time.perf_counter() - start
+            archive.unlink()
+
+            print(
+                f"{name + ':' + str(codec.level):<12}{size / 2**20:>10.1f}{size / raw_size:>8.3f}"
+                f"{compress_time:>9.2f}{raw_size / 2**20 / compress_time:>8.1f}{decompress_time:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--codecs", nargs="+", default=["deflate:9", "zstd:19", "zstd:10", "xz:9", "xz:6"])
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    main(args.size_mb, args.codecs, args.threads, args.seed)
@@ -0,0 +1,95 @@
+# Compares storing every version as a full deflate archive against keyframes
+# plus binary deltas, over a synthetic history of executables.
+#
+#   python -m benchmarks.delta_storage --size-mb 32 --versions 20 --keyframe-interval 10
+import argparse
+import random
+import time
+import zlib
+from helpers.delta import apply_delta, make_delta
+
+
+def synthetic_exe(rng, size):
+    # Alternate "code" (small alphabet, compresses a bit) and "data" (random) regions
+    chunks = []
+    while sum(map(len, chunks)) < size:
+        length = rng.randrange(64, 512) * 1024
+        if rng.random() < 0.6:
+            chunks.append(bytes(rng.choice(b"\x00\x48\x89\x8b\xe8\xc3\x0f\xff") for _ in range(4096)) * (length // 4096))
+        else:
+            chunks.append(rng.randbytes(length))
+    return b"".join(chunks)[:size]
+
+
+def next_version(rng, exe):
+    exe = bytearray(exe)
+    # A few rewritten regions, one small unaligned insertion and an occasional append
+    for _ in range(rng.randint(1, 4)):
+        start = rng.randrange(len(exe))
+        length = rng.randrange(1024, 64 * 1024)
+        exe[start : start + length] = rng.randbytes(min(length, len(exe) - start))
+    insert_at = rng.randrange(len(exe))
+    exe[insert_at:insert_at] = rng.randbytes(rng.randrange(1, 4096))
+    if rng.random() < 0.3:
+        exe += rng.randbytes(rng.randrange(4096, 256 * 1024))
+    return bytes(exe)
+
+
+def main(size_mb, versions, keyframe_interval, seed):
+    rng = random.Random(seed)
+    history = [synthetic_exe(rng, size_mb * 1024 * 1024)]
+    for _ in range(versions - 1):
+        history.append(next_version(rng, history[-1]))
+
+    full_total = 0
+    delta_total = 0
+    stored = []
+    make_times = []
+    for i, exe in enumerate(history):
+        full = zlib.compress(exe, 9)
+        full_total += len(full)
+        if i % keyframe_interval == 0:
+            stored.append(("full", full))
+            delta_total += len(full)
+        else:
+            start = time.perf_counter()
+            delta = make_delta(history[i - 1], exe)
+            make_times.append(time.perf_counter() - start)
+            stored.append(("delta", delta))
+            delta_total += len(delta)
+
+    # Rebuild the newest version from its keyframe with no cache
+    last = len(history) - 1
+    keyframe = last - last % keyframe_interval
+    start = time.perf_counter()
+    data = zlib.decompress(stored[keyframe][1])
+    for kind, blob in stored[keyframe + 1 : last + 1]:
+        data = apply_delta(data, blob)
+    cold_rebuild = time.perf_counter() - start
+    assert data == history[last]
+
+    # With the predecessor cached only one delta has to be applied
+    start = time.perf_counter()
+    data = apply_delta(history[last - 1], stored[last][1]) if last % keyframe_interval else data
+    warm_rebuild = time.perf_counter() - start
+    assert data == history[last]
+
+    raw_total = sum(map(len, history))
+    print(f"versions={versions} size={size_mb}MB keyframe_interval={keyframe_interval}")
+    print(f"raw            {raw_total / 2**20:10.1f} MB")
+    print(f"full deflate   {full_total / 2**20:10.1f} MB  ratio={full_total / raw_total:.3f}")
+    print(f"keyframe+delta {delta_total / 2**20:10.1f} MB  ratio={delta_total / raw_total:.3f}")
+    print(f"delta vs full  {delta_total / full_total:.3f}")
+    if make_times:
+        print(f"make_delta     avg={sum(make_times) / len(make_times):.2f}s")
+    print(f"rebuild newest cold={cold_rebuild:.2f}s ({last - keyframe} deltas) warm={warm_rebuild:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--versions", type=int, default=20)
+    parser.add_argument("--keyframe-interval", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    main(args.size_mb, args.versions, args.keyframe_interval, args.seed)
@@ -0,0 +1,60 @@
+# Measures how long the event loop stalls while a synthetic exe is hashed,
+# zipped and verified inline (old behaviour) versus in the worker pool.
+#
+#   python -m benchmarks.event_loop_stall --size-mb 64
+import argparse
+import asyncio
+import os
+import pathlib
+import tempfile
+import helpers.workers
+from helpers.loopmonitor import measure_lag
+
+
+def write_synthetic_exe(path, size_mb):
+    # Half random, half repetitive so deflate has real work to do
+    block = os.urandom(512 * 1024) + bytes(range(256)) * 2048
+    with path.open("wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def archive(exe_path, zip_path):
+    exe_hash = helpers.workers.hash_file(exe_path)
+    helpers.workers.compress_file(exe_path, zip_path, "PathOfExile.exe")
+    return helpers.workers.verify_zip(zip_path, "PathOfExile.exe", exe_hash)
+
+
+async def archive_inline(exe_path, zip_path):
+    return archive(exe_path, zip_path)
+
+
+async def archive_in_pool(exe_path, zip_path):
+    exe_hash = await helpers.workers.run_in_worker(helpers.workers.hash_file, exe_path)
+    await helpers.workers.run_in_worker(
+        helpers.workers.compress_file, exe_path, zip_path, "PathOfExile.exe"
+    )
+    return await helpers.workers.run_in_worker(
+        helpers.workers.verify_zip, zip_path, "PathOfExile.exe", exe_hash
+    )
+
+
+async def main(size_mb):
+    with tempfile.TemporaryDirectory() as tmp:
+        exe_path = pathlib.Path(tmp) / "PathOfExile.exe"
+        zip_path = pathlib.Path(tmp) / "PathOfExile.zip"
+        write_synthetic_exe(exe_path, size_mb)
+
+        for label, step in (("inline", archive_inline), ("pool", archive_in_pool)):
+            ok, max_lag, elapsed = await measure_lag(step(exe_path, zip_path))
+            print(
+                f"{label:<8} verified={ok} elapsed={elapsed:.2f}s max_loop_stall={max_lag * 1000:.1f}ms"
+            )
+    helpers.workers.shutdown_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main(args.size_mb))
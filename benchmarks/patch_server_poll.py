@@ -0,0 +1,55 @@
+# Load-tests the patch server poll path against a local stand-in.
+#
+#   python -m benchmarks.patch_server_poll --requests 5000 --concurrency 8
+import argparse
+import asyncio
+import statistics
+import time
+from helpers.patchserver import PatchServerClient
+from helpers.standins import PatchServerStandIn
+
+
+async def poll(clients, total):
+    latencies = []
+    remaining = iter(range(total))
+
+    async def worker(client):
+        for _ in remaining:
+            start = time.perf_counter()
+            await client.fetch()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(client) for client in clients))
+    return latencies, time.perf_counter() - start
+
+
+async def main(total, concurrency, delay):
+    async with PatchServerStandIn(delay=delay) as server:
+        for keep_alive in (False, True):
+            clients = [
+                PatchServerClient(server.host, server.port, keep_alive=keep_alive)
+                for _ in range(concurrency)
+            ]
+            server.connection_count = 0
+            latencies, elapsed = await poll(clients, total)
+            for client in clients:
+                await client.close()
+
+            latencies.sort()
+            print(
+                f"keep_alive={keep_alive!s:<5} requests={len(latencies)} "
+                f"rate={len(latencies) / elapsed:.0f}/s "
+                f"p50={statistics.median(latencies) * 1000:.2f}ms "
+                f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1000:.2f}ms "
+                f"connections={server.connection_count}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--delay", type=float, default=0)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.delay))
@@ -0,0 +1,230 @@
+# Runs the whole pipeline against local stand-ins: a patch server, a CDN serving
+# synthetic exes and a channel sink in place of discord. Each version goes live on
+# the patch server as soon as the previous one is announced, and is timed from
+# going live to its announcement. Results are appended to a JSON lines file, by
+# default the gitignored benchmarks/results/pipeline.jsonl, and compared with the
+# last run that used the same parameters.
+#
+#   python -m benchmarks.pipeline --versions 20 --size-mb 32 --archive-mode delta
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import pathlib
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import settings
+import helpers.download
+import helpers.http
+import helpers.workers
+from benchmarks.delta_storage import next_version, synthetic_exe
+from helpers.database import db
+from helpers.notifier import NotificationQueue
+from helpers.realms import Realm
+from helpers.scrubber import Scrubber
+from helpers.standins import CdnStandIn, ChannelSink, PatchServerStandIn
+from main import patch_downloader, send_pending_messages
+
+# Channel ids used by the benchmark realm
+UPLOAD_CHANNEL = 1
+NOTIFIER_CHANNEL = 2
+# Local history for compare(), kept out of git
+RESULTS_PATH = pathlib.Path(__file__).parent / "results" / "pipeline.jsonl"
+
+
+class BenchmarkBot:
+    # The attributes of MyBot that patch_downloader and send_pending_messages use
+
+    def __init__(self, realm):
+        self.notifications = NotificationQueue()
+        self.artifact_semaphore = asyncio.Semaphore(settings.ARTIFACT_CONCURRENCY)
+        self.bandwidth_limiter = helpers.download.BandwidthLimiter(settings.DOWNLOAD_BANDWIDTH_LIMIT)
+        self.realms = {realm.name: realm}
+        self.scrubber = Scrubber(io_rate=0, interval=settings.SCRUB_INTERVAL)
+        self.http_session = helpers.http.create_session()
+        self.channels = {
+            UPLOAD_CHANNEL: ChannelSink(UPLOAD_CHANNEL),
+            NOTIFIER_CHANNEL: ChannelSink(NOTIFIER_CHANNEL),
+        }
+
+    def get_channel(self, channel_id):
+        return self.channels[channel_id]
+
+    async def wait_until_ready(self):
+        pass
+
+    async def close(self):
+        await self.http_session.close()
+        for realm in self.realms.values():
+            await realm.patch_server_client.close()
+        self.scrubber.close()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def git_revision(cwd=None):
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=cwd, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(params, timeout):
+    rng = random.Random(params["seed"])
+    exe = synthetic_exe(rng, params["size_mb"] * 1024 * 1024)
+    versions = [f"3.99.0.{number}" for number in range(1, params["versions"] + 1)]
+
+    db.start()
+    async with PatchServerStandIn("0.0.0.0") as patch_server, CdnStandIn(
+        latency=params["latency"]
+    ) as cdn:
+        realm = Realm(
+            name="bench",
+            patch_server_host=patch_server.host,
+            patch_server_port=patch_server.port,
+            cdn_base_url=cdn.url_for(""),
+            channel_id=UPLOAD_CHANNEL,
+            channel_notifier_id=NOTIFIER_CHANNEL,
+            poll_interval=params["poll_interval"],
+            poll_fast_interval=params["poll_interval"],
+        )
+        bot = BenchmarkBot(realm)
+        notifier = bot.get_channel(NOTIFIER_CHANNEL)
+        # Let the downloader record a placeholder version before timing starts
+        cdn.files = {"0.0.0.0/PathOfExile.exe": exe}
+        tasks = [
+            asyncio.create_task(patch_downloader(bot, realm)),
+            asyncio.create_task(send_pending_messages(bot)),
+        ]
+        try:
+            await notifier.wait_for(lambda message: "0.0.0.0" in message.content)
+            baseline_rss = peak_rss_mb()
+
+            latencies = []
+            started = time.perf_counter()
+            for version in versions:
+                exe = next_version(rng, exe)
+                # Only the live version is kept in memory, like the real CDN serving one patch
+                cdn.files = {f"{version}/PathOfExile.exe": exe}
+                live_at = time.perf_counter()
+                patch_server.version = version
+                message = await notifier.wait_for(
+                    lambda message: message.content.endswith(f" {version}"),
+                    timeout=timeout,
+                )
+                latencies.append(message.sent_at - live_at)
+                print(f"{version:<12} announced after {latencies[-1]:6.2f}s")
+            elapsed = time.perf_counter() - started
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await bot.close()
+            db.close()
+            helpers.workers.shutdown_executor()
+
+    stored_bytes = sum(
+        path.stat().st_size for path in settings.STORAGE_DIRECTORY.rglob("*") if path.is_file()
+    )
+    return {
+        "latency_mean_s": statistics.mean(latencies),
+        "latency_p50_s": statistics.median(latencies),
+        "latency_p95_s": percentile(latencies, 0.95),
+        "latency_max_s": max(latencies),
+        "versions_per_minute": len(versions) / elapsed * 60,
+        "download_mb_per_s": len(versions) * params["size_mb"] / elapsed,
+        "cdn_requests": cdn.request_count,
+        "patch_server_requests": patch_server.request_count,
+        "stored_mb": stored_bytes / 2**20,
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages_last_s": dict(bot.notifications.stage_latency),
+    }
+
+
+def compare(results_path, record):
+    # Print the change against the most recent earlier run with the same parameters
+    previous = None
+    if results_path.exists():
+        for line in results_path.read_text().splitlines():
+            entry = json.loads(line)
+            if entry["params"] == record["params"]:
+                previous = entry
+    if previous is None:
+        print(f"No earlier run with these parameters in {results_path}.")
+        return
+
+    print(f"Compared with {previous['revision']} at {previous['timestamp']}:")
+    for key, value in record["results"].items():
+        before = previous["results"].get(key)
+        if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before:
+            print(f"  {key:<22}{before:>10.2f} -> {value:>10.2f} ({(value - before) / before:+.1%})")
+
+
+def main(params, timeout, results_path):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["BASE_DIRECTORY"] = tmp
+        os.environ["ARCHIVE_MODE"] = params["archive_mode"]
+        os.environ["ARCHIVE_CODEC"] = params["codec"]
+        os.environ["POLL_JITTER"] = "0"
+        os.environ["METRICS_ENABLED"] = "false"
+        # Keep the per-version log lines out of the report; the synthetic exes are not
+        # PE images, so PE analysis logs a warning for each one
+        logging.disable(logging.WARNING)
+        results = asyncio.run(run(params, timeout))
+
+    record = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "params": params,
+        "results": results,
+    }
+    print(json.dumps(results, indent=2))
+    compare(results_path, record)
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with results_path.open("a") as f:
+        f.write(json.dumps(record) + "\n")
+    print(f"Appended results to {results_path}.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--versions", type=int, default=20)
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.05, help="CDN latency per request in seconds")
+    parser.add_argument("--poll-interval", type=float, default=1)
+    parser.add_argument("--archive-mode", choices=["full", "delta"], default="full")
+    parser.add_argument("--codec", default="deflate")
+    parser.add_argument("--timeout", type=float, default=600, help="Give up on a version after this long")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--results", type=pathlib.Path, default=RESULTS_PATH)
+    args = parser.parse_args()
+    params = {
+        "versions": args.versions,
+        "size_mb": args.size_mb,
+        "latency": args.latency,
+        "poll_interval": args.poll_interval,
+        "archive_mode": args.archive_mode,
+        "codec": args.codec,
+        "seed": args.seed,
+    }
+    main(params, args.timeout, args.results)
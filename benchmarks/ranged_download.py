@@ -0,0 +1,82 @@
+# Exercises RangedDownloader against a local CDN stand-in: a clean run, a run
+# with injected faults, and a download that is interrupted and then resumed.
+#
+#   python -m benchmarks.ranged_download --size-mb 64 --connections 4
+import argparse
+import asyncio
+import hashlib
+import os
+import pathlib
+import tempfile
+import time
+import aiohttp
+from helpers.download import RangedDownloader
+from helpers.standins import CdnStandIn
+
+
+async def timed_download(downloader, url, path, expected_hash):
+    start = time.perf_counter()
+    exe_hash, size = await downloader.download(url, path, expected_hash)
+    assert exe_hash == expected_hash
+    return time.perf_counter() - start
+
+
+async def main(size_mb, connections, segment_mb, latency):
+    data = os.urandom(size_mb * 1024 * 1024)
+    expected_hash = hashlib.sha256(data).hexdigest()
+    files = {"1.0.0/PathOfExile.exe": data}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "PathOfExile.exe"
+        async with aiohttp.ClientSession() as session:
+            for label, options in (
+                ("single stream", {"support_ranges": False}),
+                ("ranged", {}),
+                ("ranged + faults", {"error_rate": 0.2, "truncate_rate": 0.2, "seed": 1}),
+            ):
+                async with CdnStandIn(files, latency=latency, **options) as cdn:
+                    downloader = RangedDownloader(
+                        session,
+                        segment_size=segment_mb * 1024 * 1024,
+                        connections=connections,
+                        retries=10,
+                    )
+                    elapsed = await timed_download(
+                        downloader, cdn.url_for("1.0.0/PathOfExile.exe"), path, expected_hash
+                    )
+                    print(
+                        f"{label:<16} {elapsed:6.2f}s requests={cdn.request_count} "
+                        f"sent={cdn.bytes_sent / 2**20:.1f}MB verified"
+                    )
+                    path.unlink()
+
+            # Interrupt a download part way, then resume it with a fresh downloader
+            async with CdnStandIn(files, latency=latency) as cdn:
+                url = cdn.url_for("1.0.0/PathOfExile.exe")
+                downloader = RangedDownloader(
+                    session, segment_size=segment_mb * 1024 * 1024, connections=1
+                )
+                task = asyncio.create_task(downloader.download(url, path))
+                while not RangedDownloader.sidecar_path(path).exists() or b'"done": {}' in RangedDownloader.sidecar_path(path).read_bytes():
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+                sent_before = cdn.bytes_sent
+                elapsed = await timed_download(downloader, url, path, expected_hash)
+                print(
+                    f"{'resumed':<16} {elapsed:6.2f}s re-sent={(cdn.bytes_sent - sent_before) / 2**20:.1f}MB "
+                    f"of {size_mb}MB verified"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--segment-mb", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(main(args.size_mb, args.connections, args.segment_mb, args.latency))
@@ -0,0 +1,95 @@
+# Measures startup: interpreter plus `import main`, constructing the bot, and getting
+# ready (database open and migrated, lookup indexes loaded, extensions loaded). Discord
+# login is left out. Every sample is a fresh process; the first one also creates the
+# database. --tree measures another checkout, e.g. a git worktree of an older revision.
+#
+#   python -m benchmarks.startup --runs 10
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.pipeline import compare, git_revision
+
+CHILD = """
+import asyncio, json, os, pathlib, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def ready():
+    # Log to the temporary base directory instead of the checkout's logs/.
+    # Older trees configured logging on import.
+    main.settings.LOGS_DIR = pathlib.Path(os.environ["BASE_DIRECTORY"]) / "logs"
+    getattr(main.settings, "configure_logging", lambda: None)()
+    bot = main.MyBot(command_prefix="!", intents=main.intents)
+    constructed = time.perf_counter()
+    main.db.start()
+    await main.helpers.lookup.load()
+    await bot.load_extensions()
+    main.db.close()
+    return constructed
+
+constructed = asyncio.run(ready())
+print(json.dumps({
+    "import_s": imported - started,
+    "construct_s": constructed - imported,
+    "ready_s": time.perf_counter() - started,
+}))
+"""
+
+
+def sample(tree, base_directory):
+    env = dict(os.environ, BASE_DIRECTORY=str(base_directory), PYTHONPATH=str(tree))
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=tree, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{result.stderr}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_s"] = wall
+    return timings
+
+
+def main(tree, runs, results_path):
+    with tempfile.TemporaryDirectory() as tmp:
+        cold = sample(tree, tmp)
+        warm = [sample(tree, tmp) for _ in range(runs)]
+
+    results = {"cold_process_s": cold["process_s"], "cold_ready_s": cold["ready_s"]}
+    for key in ("process_s", "import_s", "construct_s", "ready_s"):
+        results[f"{key[:-2]}_median_s"] = statistics.median(run[key] for run in warm)
+        results[f"{key[:-2]}_min_s"] = min(run[key] for run in warm)
+
+    print(f"{'':<12}{'median s':>10}{'min s':>10}")
+    for key in ("process", "import", "construct", "ready"):
+        print(f"{key:<12}{results[key + '_median_s']:>10.3f}{results[key + '_min_s']:>10.3f}")
+    print(f"{'cold ready':<12}{cold['ready_s']:>10.3f}")
+
+    if results_path:
+        record = {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "revision": git_revision(tree),
+            "python": sys.version.split()[0],
+            "params": {"runs": runs},
+            "results": results,
+        }
+        compare(results_path, record)
+        with results_path.open("a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tree", type=pathlib.Path, default=pathlib.Path(__file__).parent.parent)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--results", type=pathlib.Path, default=None)
+    args = parser.parse_args()
+    main(args.tree.absolute(), args.runs, args.results)
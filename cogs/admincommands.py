@@ -2,6 +2,7 @@ from discord.ext import commands
 import helpers.database
 import helpers.pagination
 import helpers.checks
+import helpers.lookup
 import os
 import sys
 
@@ -12,7 +13,7 @@ class AdminCommands(commands.Cog):
 
     @commands.hybrid_command(
         name="clear_tables",
-        description="Clears all data from message_log and patch tables",
+        description="Clears all data from message_log, patch and artifact tables",
     )
     async def clear_all_tables(self, ctx):
         if not await helpers.checks.same_server_as_requester(ctx):
@@ -23,8 +24,76 @@ class AdminCommands(commands.Cog):
             return
 
         result = await helpers.database.clear_tables()
+        await helpers.lookup.load()
+        helpers.pagination.page_cache.invalidate()
         await ctx.send(result, ephemeral=True)
 
+    @commands.hybrid_command(
+        name="pipeline_status",
+        description="Shows pending notifications and the latency of each stage",
+    )
+    async def pipeline_status(self, ctx):
+        if not await helpers.checks.same_server_as_requester(ctx):
+            return
+
+        if not await helpers.checks.requester_is_owner(ctx):
+            await ctx.send("You are not the owner of this bot.", ephemeral=True)
+            return
+
+        response = self.bot.notifications.status()
+        for realm in self.bot.realms.values():
+            response += f"Realm {realm.name}: polling every {realm.scheduler.current_interval:.0f}s\n"
+        await ctx.send(response, ephemeral=True)
+
+    @commands.hybrid_command(
+        name="storage_usage",
+        description="Shows archive usage per storage tier from the database",
+    )
+    async def storage_usage(self, ctx):
+        if not await helpers.checks.same_server_as_requester(ctx):
+            return
+
+        if not await helpers.checks.requester_is_owner(ctx):
+            await ctx.send("You are not the owner of this bot.", ephemeral=True)
+            return
+
+        retention = self.bot.retention
+        usage = await retention.usage()
+        response = ""
+        for tier in ("hot", "cold"):
+            count, size = usage.get(tier, (0, 0))
+            response += f"{tier}: {count} blobs, {size / 1024 ** 3:.2f} GiB\n"
+        if retention.budget:
+            response += f"Hot budget: {retention.budget / 1024 ** 3:.2f} GiB, newest {retention.keep_hot} versions per realm kept hot\n"
+        else:
+            response += "Retention is disabled (RETENTION_HOT_BUDGET=0)\n"
+        await ctx.send(response, ephemeral=True)
+
+    @commands.hybrid_command(
+        name="integrity_report",
+        description="Shows archives that are missing or failed their integrity check",
+    )
+    async def integrity_report(self, ctx, recheck: bool = False):
+        if not await helpers.checks.same_server_as_requester(ctx):
+            return
+
+        if not await helpers.checks.requester_is_owner(ctx):
+            await ctx.send("You are not the owner of this bot.", ephemeral=True)
+            return
+
+        scrubber = self.bot.scrubber
+        if recheck:
+            await ctx.defer(ephemeral=True)
+            for exe_hash, *_, version in await scrubber.problems():
+                await scrubber.scrub_one(exe_hash, version)
+
+        counts = await scrubber.summary()
+        response = ", ".join(f"{status}: {count}" for status, count in sorted(counts.items()))
+        response += "\n"
+        for exe_hash, status, detail, checked_at, versions, _ in (await scrubber.problems())[:15]:
+            response += f"**{status}** `{exe_hash[:16]}` ({versions}) <t:{checked_at}:R>\n{detail}\n"
+        await ctx.send(response[:2000], ephemeral=True)
+
     @commands.hybrid_command(name="restart", help="Restart the bot")
     async def restart(self, ctx):
         if not await helpers.checks.same_server_as_requester(ctx):
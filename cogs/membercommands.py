@@ -1,81 +1,303 @@
+import datetime
+from discord import app_commands
 from discord.ext import commands
 import discord
 import helpers.database
+import helpers.lookup
 import helpers.pagination
 import helpers.checks
 import helpers.utils
 import settings
 
 
+# Rows shown by the lookup commands; queries stop at the index after this many
+LOOKUP_LIMIT = 15
+
+
+def parse_time(value: str) -> int:
+    # Unix time, or an ISO date/datetime taken as UTC
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
+
+def version_page_source(realm: str = None):
+    # Stored versions newest first, paged on (unix_time, rowid); realm None lists every realm
+    condition = "realm = ? AND " if realm else ""
+    params = (realm,) if realm else ()
+
+    async def fetch_older(key, limit):
+        if key is None:
+            return await helpers.database.db.fetchall(
+                f"SELECT rowid, realm, version, unix_time FROM patch WHERE {condition}1 "
+                "ORDER BY unix_time DESC, rowid DESC LIMIT ?",
+                (*params, limit),
+            )
+        return await helpers.database.db.fetchall(
+            f"SELECT rowid, realm, version, unix_time FROM patch WHERE {condition}(unix_time, rowid) < (?, ?) "
+            "ORDER BY unix_time DESC, rowid DESC LIMIT ?",
+            (*params, *key, limit),
+        )
+
+    async def fetch_newer(key, limit):
+        if key is None:
+            return await helpers.database.db.fetchall(
+                f"SELECT rowid, realm, version, unix_time FROM patch WHERE {condition}1 "
+                "ORDER BY unix_time, rowid LIMIT ?",
+                (*params, limit),
+            )
+        return await helpers.database.db.fetchall(
+            f"SELECT rowid, realm, version, unix_time FROM patch WHERE {condition}(unix_time, rowid) > (?, ?) "
+            "ORDER BY unix_time, rowid LIMIT ?",
+            (*params, *key, limit),
+        )
+
+    async def count():
+        return (
+            await helpers.database.db.fetchone(
+                f"SELECT COUNT(*) FROM patch WHERE {condition}1", params
+            )
+        )[0]
+
+    def render(rows, page_index, total_pages):
+        names = [version if realm else f"{row_realm} {version}" for _, row_realm, version, _ in rows]
+        width = max((len(name) for name in names), default=0)
+        version_list = "\n".join(
+            f"**Version:** `{name.ljust(width)}` | **Stored:** <t:{unix_time}:R> <t:{unix_time}>"
+            for name, (_, _, _, unix_time) in zip(names, rows)
+        )
+        embed = discord.Embed(
+            title=f"Versions (Page {page_index}/{total_pages})",
+            description=version_list,
+            color=discord.Color.blue(),
+        )
+
+        if settings.MEGA_LINK_ENABLED:
+            embed.add_field(
+                name="Binaries:",
+                value=f"[*MEGA link to all.*]({settings.MEGA_LINK})",
+                inline=False,
+            )
+        return embed
+
+    return helpers.pagination.KeysetPageSource(
+        f"versions:{realm or '*'}",
+        fetch_older,
+        fetch_newer,
+        count,
+        render,
+        key=lambda row: (row[3], row[0]),
+    )
+
+
 class MemberCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
-    @commands.hybrid_command(
-        name="stored_pathofexile_versions", help="List all stored versions"
-    )
-    @commands.cooldown(
-        1, 60, commands.BucketType.guild
-    )  # Change cooldown to guild-based
-    async def list_versions(self, ctx):
+    async def _member_check(self, ctx):
         if not await helpers.checks.same_server_as_requester(ctx):
-            return
+            return False
 
         if not await helpers.checks.requester_has_role(
-            ctx, settings.All_COMMANDS_REQUIRED_ROLE_ID
+            ctx, settings.ALL_COMMANDS_REQUIRED_ROLE_ID
         ):
             role_name = await helpers.utils.get_role_name(
-                ctx.guild, settings.All_COMMANDS_REQUIRED_ROLE_ID
+                ctx.guild, settings.ALL_COMMANDS_REQUIRED_ROLE_ID
             )
             await ctx.send(f"You do not have the role {role_name}.", ephemeral=True)
+            return False
+        return True
+
+    async def _send_lookup(self, ctx, title, rows):
+        # rows: (realm, version, name, exe_hash, unix_time), newest first
+        if not rows:
+            await ctx.send("No matching versions stored.", ephemeral=True)
             return
+        show_realm = len(self.bot.realms) > 1
+        lines = [
+            f"{f'`{realm}` ' if show_realm else ''}**Version:** `{version}` {name} `{exe_hash[:12]}` | <t:{unix_time}:R>"
+            for realm, version, name, exe_hash, unix_time in rows
+        ]
+        if len(rows) == LOOKUP_LIMIT:
+            lines.append(f"*Showing the newest {LOOKUP_LIMIT} matches.*")
+        embed = discord.Embed(
+            title=title, description="\n".join(lines), color=discord.Color.blue()
+        )
+        await ctx.send(embed=embed, ephemeral=True)
 
-        settings.CURSOR.execute("SELECT version, unix_time FROM patch")
-        versions = settings.CURSOR.fetchall()
+    @commands.hybrid_command(
+        name="find_by_hash", help="Find versions whose exe hash starts with a prefix"
+    )
+    @commands.cooldown(1, 5, commands.BucketType.user)
+    async def find_by_hash(self, ctx, prefix: str):
+        if not await self._member_check(ctx):
+            return
 
-        if not versions:
-            await ctx.send("No versions stored.", ephemeral=True)
+        prefix = prefix.strip().lower()
+        if len(prefix) < 4 or any(char not in "0123456789abcdef" for char in prefix):
+            await ctx.send("Give at least 4 hex digits of the hash.", ephemeral=True)
             return
 
-        # Reverse the versions list to display from newest to oldest
-        versions = list(reversed(versions))
+        rows = await helpers.database.db.fetchall(
+            "SELECT realm, version, name, exe_hash, unix_time FROM artifact "
+            "WHERE exe_hash >= ? AND exe_hash < ? ORDER BY unix_time DESC LIMIT ?",
+            (*helpers.lookup.prefix_range(prefix), LOOKUP_LIMIT),
+        )
+        await self._send_lookup(ctx, f"Exe hash {prefix}…", rows)
 
-        max_version_length = max(len(version) for version, _ in versions)
+    @find_by_hash.autocomplete("prefix")
+    async def find_by_hash_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [
+            app_commands.Choice(name=exe_hash, value=exe_hash)
+            for exe_hash in helpers.lookup.exe_hashes.complete(current.strip().lower())
+        ]
 
-        async def get_page(page_index):
-            results_per_page = 15
-            start = (page_index - 1) * results_per_page
-            end = start + results_per_page
-            page_versions = versions[start:end]
-            total_pages = helpers.pagination.Pagination.compute_total_pages(
-                len(versions), results_per_page
-            )
+    @commands.hybrid_command(
+        name="find_by_version",
+        help="Find versions matching a pattern, e.g. 3.25.* (a plain value matches as a prefix)",
+    )
+    @commands.cooldown(1, 5, commands.BucketType.user)
+    async def find_by_version(self, ctx, pattern: str):
+        if not await self._member_check(ctx):
+            return
 
-            version_list = "\n".join(
-                [
-                    f"**Version:** `{version.ljust(max_version_length)}` | **Stored:** <t:{unix_time}:R> <t:{unix_time}>"
-                    for version, unix_time in page_versions
-                ]
+        pattern = pattern.strip()
+        if not any(char in pattern for char in "*?["):
+            pattern += "*"
+        prefix = helpers.lookup.glob_prefix(pattern)
+        if prefix:
+            # Seek on the version index, then filter the remaining wildcards
+            rows = await helpers.database.db.fetchall(
+                "SELECT realm, version, name, exe_hash, unix_time FROM artifact "
+                "WHERE version >= ? AND version < ? AND version GLOB ? "
+                "ORDER BY unix_time DESC LIMIT ?",
+                (*helpers.lookup.prefix_range(prefix), pattern, LOOKUP_LIMIT),
             )
-
-            embed = discord.Embed(
-                title=f"Versions (Page {page_index}/{total_pages})",
-                description=version_list,
-                color=discord.Color.blue(),
+        else:
+            # A leading wildcard cannot use the index; walk newest first and stop at LIMIT
+            rows = await helpers.database.db.fetchall(
+                "SELECT realm, version, name, exe_hash, unix_time FROM artifact "
+                "WHERE version GLOB ? ORDER BY unix_time DESC LIMIT ?",
+                (pattern, LOOKUP_LIMIT),
             )
+        await self._send_lookup(ctx, f"Versions matching {pattern}", rows)
 
-            if settings.MEGA_LINK_ENABLED:
-                embed.add_field(
-                    name="Binaries:",
-                    value=f"[*MEGA link to all.*]({settings.MEGA_LINK})",
-                    inline=False,
-                )
+    @find_by_version.autocomplete("pattern")
+    async def find_by_version_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [
+            app_commands.Choice(name=version, value=version)
+            for version in helpers.lookup.versions.complete(current.strip())
+        ]
+
+    @commands.hybrid_command(
+        name="find_by_time",
+        help="Find versions stored in a time range (unix time or YYYY-MM-DD, UTC)",
+    )
+    @commands.cooldown(1, 5, commands.BucketType.user)
+    async def find_by_time(self, ctx, since: str, until: str = None):
+        if not await self._member_check(ctx):
+            return
+
+        try:
+            start = parse_time(since)
+            end = parse_time(until) if until else int(datetime.datetime.now().timestamp()) + 1
+        except ValueError:
+            await ctx.send("Use a unix time or a date like 2024-12-06.", ephemeral=True)
+            return
 
-            return embed, total_pages
+        rows = await helpers.database.db.fetchall(
+            "SELECT realm, version, name, exe_hash, unix_time FROM artifact "
+            "WHERE unix_time >= ? AND unix_time < ? ORDER BY unix_time DESC LIMIT ?",
+            (start, end, LOOKUP_LIMIT),
+        )
+        await self._send_lookup(ctx, f"Stored between <t:{start}:d> and <t:{end}:d>", rows)
+
+    @commands.hybrid_command(
+        name="stored_pathofexile_versions", help="List all stored versions"
+    )
+    @commands.cooldown(1, 5, commands.BucketType.user)
+    async def list_versions(self, ctx, realm: str = None):
+        if not await self._member_check(ctx):
+            return
+
+        if realm is None and len(self.bot.realms) == 1:
+            realm = next(iter(self.bot.realms))
+        source = version_page_source(realm)
+        embed, _ = await source.get_page(1)
+        if not embed.description:
+            await ctx.send("No versions stored.", ephemeral=True)
+            return
 
-        view = helpers.pagination.Pagination(ctx.interaction, get_page)
+        view = helpers.pagination.Pagination(ctx.interaction, source.get_page)
         await view.navigate()
 
+    @commands.hybrid_command(
+        name="section_diff", help="Show which exe sections changed between two versions"
+    )
+    @commands.cooldown(1, 10, commands.BucketType.user)
+    async def section_diff(
+        self, ctx, old_version: str, new_version: str, realm: str = None, artifact: str = None
+    ):
+        if not await self._member_check(ctx):
+            return
+
+        realm = self.bot.realms.get(realm or next(iter(self.bot.realms)))
+        if realm is None:
+            await ctx.send("Unknown realm.", ephemeral=True)
+            return
+        artifact = artifact or realm.artifacts[0]
+
+        images = []
+        for version in (old_version, new_version):
+            image = await helpers.database.db.fetchone(
+                "SELECT artifact.exe_hash, pe_image.timestamp, pe_image.file_version FROM artifact "
+                "JOIN pe_image ON pe_image.exe_hash = artifact.exe_hash "
+                "WHERE artifact.realm=? AND artifact.version=? AND artifact.name=?",
+                (realm.name, version, artifact),
+            )
+            if image is None:
+                await ctx.send(
+                    f"No analyzed {artifact} stored for version `{version}`.", ephemeral=True
+                )
+                return
+            sections = await helpers.database.db.fetchall(
+                "SELECT name, raw_size, sha256 FROM pe_section WHERE exe_hash=? ORDER BY idx",
+                (image[0],),
+            )
+            images.append((image, {name: (raw_size, sha256) for name, raw_size, sha256 in sections}))
+
+        (old_image, old_sections), (new_image, new_sections) = images
+        lines = []
+        for name in list(old_sections) + [name for name in new_sections if name not in old_sections]:
+            if name not in new_sections:
+                lines.append(f"`{name:<8}` removed")
+            elif name not in old_sections:
+                lines.append(f"`{name:<8}` added ({new_sections[name][0]} bytes)")
+            elif old_sections[name][1] != new_sections[name][1]:
+                change = new_sections[name][0] - old_sections[name][0]
+                lines.append(f"`{name:<8}` changed ({change:+} bytes)")
+            else:
+                lines.append(f"`{name:<8}` unchanged")
+
+        embed = discord.Embed(
+            title=f"{artifact} {old_version} -> {new_version}",
+            description="\n".join(lines),
+            color=discord.Color.blue(),
+        )
+        for label, (exe_hash, timestamp, file_version) in (
+            (old_version, old_image),
+            (new_version, new_image),
+        ):
+            embed.add_field(
+                name=label,
+                value=f"Built <t:{timestamp}>\nFile version `{file_version}`\n`{exe_hash[:16]}`",
+                inline=True,
+            )
+        await ctx.send(embed=embed, ephemeral=True)
+
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
         if isinstance(error, commands.CommandOnCooldown):
@@ -0,0 +1,284 @@
+import collections
+import contextlib
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import settings
+import helpers.delta
+import helpers.workers
+from helpers.codecs import CODECS, get_codec
+from helpers.database import db
+
+logger = logging.getLogger(__name__)
+
+ARCNAME = "PathOfExile.exe"
+DELTA_SUFFIX = ".delta"
+
+
+class BlobStore:
+    # Archives keyed by the SHA-256 of the exe they contain: root/ab/abcdef....zip.
+    # Versions point at blobs through patch.exe_hash, so identical binaries are stored once.
+    # The suffix is the codec's extension, or .delta for a diff against blob.base_hash.
+    # New blobs go to the hot tier; retention may move them to the cold tier (blob.tier).
+
+    def __init__(self, root: pathlib.Path = None, cold_root: pathlib.Path = None):
+        # The tiers default to the settings, read when the store is first used
+        self._roots = None
+        if root:
+            self._roots = {"hot": root}
+            if cold_root:
+                self._roots["cold"] = cold_root
+
+    @property
+    def roots(self) -> dict:
+        if self._roots is None:
+            self._roots = {
+                "hot": settings.STORAGE_DIRECTORY / "blobs",
+                "cold": settings.COLD_STORAGE_DIRECTORY,
+            }
+        return self._roots
+
+    def path_for(
+        self, exe_hash: str, kind: str = "full", codec: str = "deflate", tier: str = "hot"
+    ) -> pathlib.Path:
+        suffix = DELTA_SUFFIX if kind == "delta" else CODECS[codec].extension
+        return self.roots[tier] / exe_hash[:2] / f"{exe_hash}{suffix}"
+
+    def locate(self, exe_hash: str, kind: str = "full", codec: str = "deflate") -> pathlib.Path:
+        # Path of the blob in whichever tier holds it, hot first
+        for tier in self.roots:
+            path = self.path_for(exe_hash, kind, codec, tier)
+            if path.exists():
+                return path
+        return self.path_for(exe_hash, kind, codec)
+
+    def find(self, exe_hash: str):
+        # (path, kind, codec) of the stored blob, or None
+        for tier in self.roots:
+            if self.path_for(exe_hash, "delta", tier=tier).exists():
+                return self.path_for(exe_hash, "delta", tier=tier), "delta", None
+            for codec in CODECS:
+                path = self.path_for(exe_hash, "full", codec, tier)
+                if path.exists():
+                    return path, "full", codec
+        return None
+
+    def exists(self, exe_hash: str) -> bool:
+        return self.find(exe_hash) is not None
+
+    def put(self, exe_hash: str, archive_path: pathlib.Path, kind: str = "full", codec: str = "deflate") -> pathlib.Path:
+        # Move a finished archive into the store; a blob that is already present wins
+        blob_path = self.path_for(exe_hash, kind, codec)
+        if blob_path.exists():
+            archive_path.unlink()
+            return blob_path
+        blob_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(archive_path, blob_path)
+        return blob_path
+
+
+class ReconstructionCache:
+    # Exes rebuilt from delta chains (and zips built from them for upload), newest kept.
+    # Workers only write entries; the event loop prunes, so its pins cover every eviction.
+
+    def __init__(self, root: pathlib.Path = None, max_entries: int = None):
+        # root and max_entries default to the settings, read when the cache is first used
+        self._root = root
+        self._max_entries = max_entries
+        self._pins = collections.Counter()
+
+    @property
+    def root(self) -> pathlib.Path:
+        if self._root is None:
+            self._root = settings.STORAGE_DIRECTORY / "cache"
+        return self._root
+
+    @property
+    def max_entries(self) -> int:
+        if self._max_entries is None:
+            self._max_entries = settings.DELTA_CACHE_SIZE
+        return self._max_entries
+
+    def path_for(self, exe_hash: str, suffix: str = ".exe") -> pathlib.Path:
+        return self.root / f"{exe_hash}{suffix}"
+
+    def get(self, exe_hash: str, suffix: str = ".exe"):
+        path = self.path_for(exe_hash, suffix)
+        if not path.exists():
+            return None
+        path.touch()
+        return path
+
+    @contextlib.contextmanager
+    def pin(self, exe_hash: str, suffix: str = ".exe"):
+        # Keep an entry while it is in use; pin before materialize so it cannot be
+        # evicted between being rebuilt and being read
+        path = self.path_for(exe_hash, suffix)
+        self._pins[path] += 1
+        try:
+            yield
+        finally:
+            self._pins[path] -= 1
+            if not self._pins[path]:
+                del self._pins[path]
+
+    def put(self, exe_hash: str, data: bytes, suffix: str = ".exe") -> pathlib.Path:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(exe_hash, suffix)
+        temp_path = path.with_name(path.name + ".tmp")
+        temp_path.write_bytes(data)
+        os.replace(temp_path, path)
+        return path
+
+    def put_file(self, exe_hash: str, source_path: pathlib.Path, suffix: str = ".exe") -> pathlib.Path:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path_for(exe_hash, suffix)
+        temp_path = path.with_name(path.name + ".tmp")
+        shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, path)
+        return path
+
+    def prune(self, keep: pathlib.Path = None):
+        # keep is the entry just written, which the caller is about to use
+        entries = sorted(
+            (path for path in self.root.iterdir() if path.suffix != ".tmp"),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True,
+        )
+        for path in entries[self.max_entries :]:
+            if path != keep and path not in self._pins:
+                path.unlink(missing_ok=True)
+
+
+blobs = BlobStore()
+cache = ReconstructionCache()
+
+
+def rebuild_exe(chain, store, cache):
+    # Worker step: chain is [(exe_hash, kind, codec), ...] from a keyframe to the wanted exe.
+    # Start from the newest link that is already cached.
+    data = None
+    start = 0
+    for i in range(len(chain) - 1, -1, -1):
+        cached = cache.get(chain[i][0])
+        if cached:
+            try:
+                data = cached.read_bytes()
+            except FileNotFoundError:
+                # Evicted by a concurrent prune; fall back to an older link
+                continue
+            start = i + 1
+            break
+
+    if data is None:
+        keyframe_hash, kind, codec = chain[0]
+        if kind != "full":
+            raise ValueError(f"Delta chain for {chain[-1][0]} does not start at a keyframe")
+        data = get_codec(codec).read(store.locate(keyframe_hash, kind, codec), ARCNAME)
+        start = 1
+
+    for exe_hash, kind, _ in chain[start:]:
+        data = helpers.delta.apply_delta(data, store.locate(exe_hash, kind).read_bytes())
+
+    target_hash = chain[-1][0]
+    if hashlib.sha256(data).hexdigest() != target_hash:
+        raise ValueError(f"Rebuilt exe does not match {target_hash}")
+    return cache.put(target_hash, data)
+
+
+async def load_chain(exe_hash):
+    rows = await db.fetchall(
+        """WITH RECURSIVE chain (exe_hash, kind, codec, base_hash, depth) AS (
+                 SELECT exe_hash, kind, codec, base_hash, 0 FROM blob WHERE exe_hash = ?
+                 UNION ALL
+                 SELECT blob.exe_hash, blob.kind, blob.codec, blob.base_hash, chain.depth + 1
+                 FROM blob JOIN chain ON blob.exe_hash = chain.base_hash
+                 WHERE chain.kind = 'delta')
+           SELECT exe_hash, kind, codec FROM chain ORDER BY depth DESC""",
+        (exe_hash,),
+    )
+    if not rows:
+        raise LookupError(f"No blob recorded for {exe_hash}")
+    return rows
+
+
+async def materialize(exe_hash):
+    # Path to the raw exe, rebuilt from its keyframe and deltas if needed
+    cached = cache.get(exe_hash)
+    if cached:
+        return cached
+    chain = await load_chain(exe_hash)
+    path = await helpers.workers.run_in_worker(rebuild_exe, chain, blobs, cache)
+    cache.prune(keep=path)
+    return path
+
+
+def configured_codec():
+    return get_codec(
+        settings.ARCHIVE_CODEC, settings.ARCHIVE_CODEC_LEVEL, settings.ARCHIVE_CODEC_THREADS
+    )
+
+
+async def store_exe(exe_path, exe_hash, exe_size, arcname=ARCNAME, realm="poe"):
+    # Archive a downloaded exe; returns (kind, base_hash, chain_length, size, codec) or None
+    if settings.ARCHIVE_MODE == "delta":
+        # Diff against the previous build of the same file in the same realm
+        previous = await db.fetchone(
+            "SELECT blob.exe_hash, blob.chain_length FROM artifact "
+            "JOIN blob ON blob.exe_hash = artifact.exe_hash "
+            "WHERE artifact.realm = ? AND artifact.name = ? "
+            "ORDER BY artifact.unix_time DESC LIMIT 1",
+            (realm, arcname),
+        )
+        if previous and previous[1] + 1 < settings.DELTA_KEYFRAME_INTERVAL:
+            base_hash, chain_length = previous
+            delta_path = exe_path.with_suffix(DELTA_SUFFIX)
+            with cache.pin(base_hash):
+                base_path = await materialize(base_hash)
+                size = await helpers.workers.run_in_worker(
+                    helpers.delta.write_delta, base_path, exe_path, delta_path, exe_hash
+                )
+            if size < exe_size * settings.DELTA_MAX_RATIO:
+                blobs.put(exe_hash, delta_path, "delta")
+                # The next version will be diffed against this one
+                cached = await helpers.workers.run_in_worker(cache.put_file, exe_hash, exe_path)
+                cache.prune(keep=cached)
+                return "delta", base_hash, chain_length + 1, size, None
+            logger.info("Delta for %s is %s bytes, storing a keyframe instead.", exe_hash, size)
+            delta_path.unlink()
+
+    codec = configured_codec()
+    archive = exe_path.with_suffix(codec.extension)
+    size = await helpers.workers.run_in_worker(codec.compress, exe_path, archive, arcname)
+    if not await helpers.workers.run_in_worker(codec.verify, archive, arcname, exe_hash):
+        archive.unlink()
+        return None
+    blobs.put(exe_hash, archive, "full", codec.name)
+    return "full", None, 0, size, codec.name
+
+
+async def archive_path(version: str, exe_hash: str, arcname=ARCNAME):
+    # (path, extension) of an archive of the version's exe, ready to upload
+    found = blobs.find(exe_hash)
+    if found and found[1] == "full":
+        return found[0], CODECS[found[2]].extension
+
+    if found:
+        # Deltas are uploaded as a plain zip of the rebuilt exe
+        zip_path = cache.get(exe_hash, ".zip")
+        if zip_path is None:
+            zip_path = cache.path_for(exe_hash, ".zip")
+            temp_path = zip_path.with_name(zip_path.name + ".tmp")
+            with cache.pin(exe_hash):
+                exe_path = await materialize(exe_hash)
+                await helpers.workers.run_in_worker(
+                    helpers.workers.compress_file, exe_path, temp_path, arcname
+                )
+            os.replace(temp_path, zip_path)
+            cache.prune(keep=zip_path)
+        return zip_path, ".zip"
+
+    # Versions stored before the blob store still live at STORAGE_DIRECTORY/{version}.zip
+    return settings.STORAGE_DIRECTORY / f"{version}.zip", ".zip"
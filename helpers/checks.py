@@ -4,7 +4,7 @@ import discord
 
 
 async def same_server_as_requester(ctx: commands.Context):
-    return ctx.guild.id == settings.BASE_SERVER_ID.id
+    return ctx.guild.id == settings.BASE_SERVER_ID
 
 
 async def requester_is_owner(ctx: commands.Context):
@@ -0,0 +1,136 @@
+import contextlib
+import hashlib
+import lzma
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
+import helpers.workers
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Codec:
+    # How a full exe archive is written and read back. Instances are picklable so
+    # their methods can run in a process pool.
+    name = None
+    extension = None
+    default_level = None
+    # Valid compression levels
+    levels = None
+
+    def __init__(self, level: int = None, threads: int = 0):
+        self.level = self.default_level if level is None else level
+        self.threads = threads or os.cpu_count() or 1
+
+    def compress(self, source_path, dest_path, arcname) -> int:
+        raise NotImplementedError
+
+    def open_member(self, path, arcname):
+        raise NotImplementedError
+
+    def read(self, path, arcname) -> bytes:
+        with self.open_member(path, arcname) as member:
+            return member.read()
+
+    def hash_contents(self, path, arcname, chunk_size=CHUNK_SIZE) -> str:
+        hash_object = hashlib.sha256()
+        with self.open_member(path, arcname) as member:
+            while chunk := member.read(chunk_size):
+                hash_object.update(chunk)
+        return hash_object.hexdigest()
+
+    def verify(self, path, arcname, expected_hash) -> bool:
+        return self.hash_contents(path, arcname) == expected_hash
+
+
+class DeflateCodec(Codec):
+    # A regular zip, single threaded
+    name = "deflate"
+    extension = ".zip"
+    default_level = 9
+    levels = range(0, 10)
+
+    def compress(self, source_path, dest_path, arcname):
+        return helpers.workers.compress_file(source_path, dest_path, arcname, self.level)
+
+    @contextlib.contextmanager
+    def open_member(self, path, arcname):
+        # Blobs hold a single file, so fall back to it when the name is not known
+        with ZipFile(path, "r") as zipf:
+            if arcname not in zipf.namelist():
+                arcname = zipf.namelist()[0]
+            with zipf.open(arcname) as member:
+                yield member
+
+
+class ZstdCodec(Codec):
+    # Raw exe in a zstd frame, compressed on all worker threads
+    name = "zstd"
+    extension = ".exe.zst"
+    default_level = 19
+    levels = range(1, 23)
+
+    def __init__(self, level: int = None, threads: int = 0):
+        if zstandard is None:
+            raise ValueError("The zstd codec needs the 'zstandard' package installed.")
+        super().__init__(level, threads)
+
+    def compress(self, source_path, dest_path, arcname):
+        compressor = zstandard.ZstdCompressor(level=self.level, threads=self.threads)
+        with open(source_path, "rb") as src, open(dest_path, "wb") as dst:
+            compressor.copy_stream(src, dst, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE)
+        return dest_path.stat().st_size
+
+    @contextlib.contextmanager
+    def open_member(self, path, arcname):
+        with open(path, "rb") as f, zstandard.ZstdDecompressor().stream_reader(f) as reader:
+            yield reader
+
+
+class XzCodec(Codec):
+    # Raw exe as concatenated xz streams. Python's lzma has no threading of its own,
+    # so the input is split into blocks that are compressed in parallel.
+    name = "xz"
+    extension = ".exe.xz"
+    default_level = 9
+    levels = range(0, 10)
+    block_size = 16 * 1024 * 1024
+    # A preset 9 compressor needs about 670 MB, so the default stays small-container friendly
+    max_default_threads = 4
+
+    def __init__(self, level: int = None, threads: int = 0):
+        super().__init__(level, threads or min(os.cpu_count() or 1, self.max_default_threads))
+
+    def compress(self, source_path, dest_path, arcname):
+        pending = deque()
+        with open(source_path, "rb") as src, open(dest_path, "wb") as dst, ThreadPoolExecutor(
+            max_workers=self.threads, thread_name_prefix="xz"
+        ) as pool:
+            while block := src.read(self.block_size):
+                pending.append(pool.submit(lzma.compress, block, preset=self.level))
+                # One block per thread in flight bounds memory to threads compressors
+                if len(pending) >= self.threads:
+                    dst.write(pending.popleft().result())
+            while pending:
+                dst.write(pending.popleft().result())
+        return dest_path.stat().st_size
+
+    @contextlib.contextmanager
+    def open_member(self, path, arcname):
+        with lzma.open(path, "rb") as member:
+            yield member
+
+
+CODECS = {codec.name: codec for codec in (DeflateCodec, ZstdCodec, XzCodec)}
+
+
+def get_codec(name: str, level: int = None, threads: int = 0) -> Codec:
+    if name not in CODECS:
+        raise ValueError(f"Unknown archive codec '{name}', expected one of {list(CODECS)}")
+    return CODECS[name](level, threads)
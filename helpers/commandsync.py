@@ -0,0 +1,37 @@
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def tree_hash(tree, guild) -> str:
+    # SHA-256 of the payload a sync would upload for this guild
+    payload = {
+        "guild": guild.id if guild else None,
+        "commands": sorted(
+            (command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+            key=lambda command: (command.get("type", 1), command["name"]),
+        ),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+async def sync_if_changed(tree, guild, hash_path) -> bool:
+    # Sync only when the commands differ from the last successful sync; returns whether it synced.
+    # Syncing is rate limited by discord, so reconnects and plain restarts skip it.
+    current = tree_hash(tree, guild)
+    try:
+        previous = hash_path.read_text().strip()
+    except FileNotFoundError:
+        previous = None
+    if current == previous:
+        logger.info("Command tree unchanged since the last sync, skipping it.")
+        return False
+
+    synced = await tree.sync(guild=guild)
+    # Written only after the sync succeeded, so a failed sync is retried on the next start
+    hash_path.parent.mkdir(parents=True, exist_ok=True)
+    hash_path.write_text(current + "\n")
+    logger.info("Synced %s commands, tree hash %s.", len(synced), current[:12])
+    return True
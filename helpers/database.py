@@ -1,25 +1,207 @@
+import asyncio
+import logging
+import pathlib
+import queue
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import settings
+import helpers.migrations
+
+logger = logging.getLogger(__name__)
+
+
+def _resolve(future, result=None, error=None):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class Database:
+    # SQLite access that never blocks the event loop. Writes go to a single writer
+    # thread that commits in batches; reads run on a small pool of reader connections.
+
+    def __init__(self, path=None, readers: int = None, batch_size: int = 64):
+        # path and readers default to the settings, read when the database is first used
+        self.path = path
+        self.readers = readers
+        self.batch_size = batch_size
+        self._writes = queue.Queue()
+        self._writer_thread = None
+        self._reader_pool = None
+        self._local = threading.local()
+        self._start_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def start(self):
+        with self._start_lock:
+            if self._writer_thread is not None:
+                return
+            self.path = self.path or settings.DATABASE_PATH
+            self.readers = self.readers or settings.DATABASE_READERS
+            pathlib.Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = self._connect()
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            helpers.migrations.migrate(conn)
+            self._reader_pool = ThreadPoolExecutor(
+                max_workers=self.readers, thread_name_prefix="db-reader"
+            )
+            self._writer_thread = threading.Thread(
+                target=self._writer, args=(conn,), name="db-writer", daemon=True
+            )
+            self._writer_thread.start()
+            logger.info("Database opened at %s in WAL mode.", self.path)
+
+    def close(self):
+        if self._writer_thread is None:
+            return
+        self._writes.put(None)
+        self._writer_thread.join()
+        self._reader_pool.shutdown(wait=True)
+        self._writer_thread = None
+        self._reader_pool = None
+
+    def _writer(self, conn):
+        while True:
+            jobs = [self._writes.get()]
+            # Drain whatever else is waiting so the batch shares one commit
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = None in jobs
+            jobs = [job for job in jobs if job is not None]
+            results = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for statements, future, loop in jobs:
+                    # A savepoint per job keeps one failing job from rolling back the batch
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        row_ids = []
+                        for sql, params, many in statements:
+                            cursor = (
+                                conn.executemany(sql, params)
+                                if many
+                                else conn.execute(sql, params)
+                            )
+                            row_ids.append(cursor.lastrowid)
+                        conn.execute("RELEASE job")
+                        results.append((future, loop, row_ids, None))
+                    except Exception as e:
+                        # Not only sqlite3.Error: binding a too large int raises OverflowError
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        results.append((future, loop, None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                logger.exception("Database write batch of %s jobs failed.", len(jobs))
+                try:
+                    if conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    logger.exception("Rolling back the failed batch failed.")
+                results = [(future, loop, None, e) for _, future, loop in jobs]
+
+            for future, loop, row_ids, error in results:
+                try:
+                    loop.call_soon_threadsafe(_resolve, future, row_ids, error)
+                except RuntimeError:
+                    # The caller's loop closed while the job was queued, nobody is waiting
+                    logger.debug("Dropped a database result for a closed event loop.")
+
+            if stop:
+                conn.close()
+                return
+
+    def _reader_connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only = ON")
+            self._local.conn = conn
+        return conn
+
+    def _read(self, sql, params, fetch):
+        cursor = self._reader_connection().execute(sql, params)
+        try:
+            return cursor.fetchone() if fetch == "one" else cursor.fetchall()
+        finally:
+            cursor.close()
+
+    async def fetchone(self, sql, params=()):
+        self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._reader_pool, self._read, sql, params, "one"
+        )
+
+    async def fetchall(self, sql, params=()):
+        self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._reader_pool, self._read, sql, params, "all"
+        )
+
+    async def _submit(self, statements):
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._writes.put((statements, future, loop))
+        return await future
+
+    async def transaction(self, statements):
+        # Run [(sql, params), ...] atomically; returns the lastrowid of each statement
+        return await self._submit([(sql, params, False) for sql, params in statements])
+
+    async def execute(self, sql, params=()):
+        row_ids = await self.transaction([(sql, params)])
+        return row_ids[0]
+
+    async def executemany(self, sql, seq_of_params):
+        await self._submit([(sql, list(seq_of_params), True)])
+
+
+db = Database()
 
 
 async def clear_tables():
     try:
         # Select and count rows before deleting
-        settings.CURSOR.execute("SELECT COUNT(*) FROM message_log")
-        message_log_count = settings.CURSOR.fetchone()[0]
-
-        settings.CURSOR.execute("SELECT COUNT(*) FROM patch")
-        patch_count = settings.CURSOR.fetchone()[0]
+        message_log_count = (await db.fetchone("SELECT COUNT(*) FROM message_log"))[0]
+        patch_count = (await db.fetchone("SELECT COUNT(*) FROM patch"))[0]
+        artifact_count = (await db.fetchone("SELECT COUNT(*) FROM artifact"))[0]
 
-        # Delete the rows
-        settings.CURSOR.execute("DELETE FROM message_log")
-        settings.CURSOR.execute("DELETE FROM patch")
-        settings.CONN.commit()
+        # Delete the rows; artifact rows go too, or re-downloading a cleared version
+        # would hit their unique index. Blobs stay, they are shared by content.
+        await db.transaction(
+            [
+                ("DELETE FROM message_log", ()),
+                ("DELETE FROM patch", ()),
+                ("DELETE FROM artifact", ()),
+            ]
+        )
 
         # Format the response
         response = f"Cleared the following data:\n\n"
         response += f"message_log table: {message_log_count} rows\n"
         response += f"patch table: {patch_count} rows\n"
+        response += f"artifact table: {artifact_count} rows\n"
 
         return response
 
@@ -0,0 +1,110 @@
+import hashlib
+import lzma
+import struct
+
+# Binary delta between two builds of an executable.
+#
+# The target is walked in fixed-size blocks. Each block is looked up in an index
+# of the base's aligned blocks (PE sections are file-aligned, so unchanged
+# sections usually line up) and, failing that, searched for in a window around
+# where the previous match left off, which catches small unaligned shifts.
+# Matches become COPY ops, everything else LITERAL ops, and the op stream is
+# xz-compressed.
+
+MAGIC = b"PDLT1"
+BLOCK_SIZE = 512
+ANCHOR_SIZE = 64
+SEARCH_WINDOW = 64 * 1024
+
+_HEADER = struct.Struct(">5sQQ")
+_COPY = struct.Struct(">cQI")
+_LITERAL = struct.Struct(">cI")
+
+
+def _digest(block):
+    return hashlib.blake2b(block, digest_size=8).digest()
+
+
+def make_delta(base: bytes, target: bytes, block_size: int = BLOCK_SIZE) -> bytes:
+    index = {}
+    for offset in range(0, len(base) - block_size + 1, block_size):
+        index.setdefault(_digest(base[offset : offset + block_size]), offset)
+
+    out = bytearray(_HEADER.pack(MAGIC, len(base), len(target)))
+    literal_start = 0
+    base_cursor = 0
+    pos = 0
+
+    def flush_literal(end):
+        if end > literal_start:
+            out.extend(_LITERAL.pack(b"L", end - literal_start))
+            out.extend(target[literal_start:end])
+
+    while pos + block_size <= len(target):
+        block = target[pos : pos + block_size]
+        offset = index.get(_digest(block))
+        if offset is None or base[offset : offset + block_size] != block:
+            # Look near where the base would be if only bytes were inserted or removed
+            expected = base_cursor + (pos - literal_start)
+            offset = base.find(
+                target[pos : pos + ANCHOR_SIZE],
+                max(0, expected - SEARCH_WINDOW),
+                expected + SEARCH_WINDOW,
+            )
+            if offset < 0 or base[offset : offset + block_size] != block:
+                pos += block_size
+                continue
+
+        length = block_size
+        while (
+            pos + length + block_size <= len(target)
+            and base[offset + length : offset + length + block_size]
+            == target[pos + length : pos + length + block_size]
+        ):
+            length += block_size
+
+        flush_literal(pos)
+        out.extend(_COPY.pack(b"C", offset, length))
+        pos += length
+        literal_start = pos
+        base_cursor = offset + length
+
+    flush_literal(len(target))
+    return lzma.compress(bytes(out), preset=6)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    data = lzma.decompress(delta)
+    magic, base_size, target_size = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a patch delta")
+    if base_size != len(base):
+        raise ValueError(f"Delta expects a {base_size} byte base, got {len(base)}")
+
+    target = bytearray()
+    pos = _HEADER.size
+    while pos < len(data):
+        if data[pos : pos + 1] == b"C":
+            _, offset, length = _COPY.unpack_from(data, pos)
+            pos += _COPY.size
+            target.extend(base[offset : offset + length])
+        else:
+            _, length = _LITERAL.unpack_from(data, pos)
+            pos += _LITERAL.size
+            target.extend(data[pos : pos + length])
+            pos += length
+
+    if len(target) != target_size:
+        raise ValueError(f"Delta produced {len(target)} bytes, expected {target_size}")
+    return bytes(target)
+
+
+def write_delta(base_path, target_path, delta_path, expected_hash):
+    # Worker step: diff two exes on disk and check the delta rebuilds the target exactly
+    base = base_path.read_bytes()
+    target = target_path.read_bytes()
+    delta = make_delta(base, target)
+    if hashlib.sha256(apply_delta(base, delta)).hexdigest() != expected_hash:
+        raise ValueError("Delta does not reproduce the target exe")
+    delta_path.write_bytes(delta)
+    return len(delta)
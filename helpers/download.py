@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import aiohttp
+import helpers.metrics
+import helpers.workers
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+MIN_EXE_SIZE = 3 * 1024 * 1024
+
+
+class BandwidthLimiter:
+    # Token bucket shared by every download so concurrent realms and segments
+    # together stay under one byte rate. A rate of 0 disables the limit.
+
+    def __init__(self, bytes_per_second: int, burst: int = None):
+        self.rate = bytes_per_second
+        self.burst = burst or max(bytes_per_second, CHUNK_SIZE)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def consume(self, size: int):
+        if not self.rate:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= size
+            if self.tokens < 0:
+                # Waiting while holding the lock keeps the other downloads queued behind us
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+UNLIMITED = BandwidthLimiter(0)
+
+
+async def stream_to_file(
+    response, path, min_size=MIN_EXE_SIZE, chunk_size=CHUNK_SIZE, limiter=UNLIMITED
+):
+    # Write the response body to disk while hashing and measuring it in the same pass.
+    # Returns (exe_hash, size), or None if the file is smaller than min_size.
+    if response.content_length is not None and response.content_length < min_size:
+        logger.info(
+            "Remote file is %s bytes, smaller than %s. Skipping download.",
+            response.content_length,
+            min_size,
+        )
+        return None
+
+    hash_object = hashlib.sha256()
+    size = 0
+    try:
+        with path.open("wb") as f:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                await limiter.consume(len(chunk))
+                f.write(chunk)
+                hash_object.update(chunk)
+                size += len(chunk)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+    if size < min_size:
+        logger.info("Raw file `%s` is smaller than %s bytes. Skipping download.", path, min_size)
+        path.unlink()
+        return None
+
+    return hash_object.hexdigest(), size
+
+
+def _hash_range(path, offset, length, chunk_size=CHUNK_SIZE):
+    hash_object = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            hash_object.update(chunk)
+            length -= len(chunk)
+    return hash_object.hexdigest()
+
+
+class RangedDownloader:
+    # Downloads a file as concurrent HTTP Range segments over a shared session.
+    # Finished segments are recorded with their SHA-256 in a sidecar file next to
+    # the download, so a failed or interrupted download resumes where it stopped.
+
+    def __init__(
+        self,
+        session,
+        segment_size: int = 8 * 1024 * 1024,
+        connections: int = 4,
+        retries: int = 3,
+        min_size: int = MIN_EXE_SIZE,
+        limiter: BandwidthLimiter = UNLIMITED,
+    ):
+        self.session = session
+        self.segment_size = segment_size
+        self.connections = connections
+        self.retries = retries
+        self.min_size = min_size
+        self.limiter = limiter
+
+    @staticmethod
+    def sidecar_path(path):
+        return path.with_name(path.name + ".part.json")
+
+    async def download(self, url, path, expected_hash=None):
+        # Returns (exe_hash, size), or None if the remote file is smaller than min_size
+        async with self.session.head(url, allow_redirects=True) as response:
+            response.raise_for_status()
+            size = response.content_length
+            accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+            validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+
+        if size is not None and size < self.min_size:
+            logger.info(
+                "Remote file is %s bytes, smaller than %s. Skipping download.", size, self.min_size
+            )
+            return None
+
+        if not size or not accepts_ranges:
+            logger.debug("%s does not support ranged downloads, streaming it instead.", url)
+            async with self.session.get(url) as response:
+                response.raise_for_status()
+                return await stream_to_file(
+                    response, path, self.min_size, limiter=self.limiter
+                )
+
+        state = await self._load_state(url, path, size, validator)
+        segments = [
+            (index, offset, min(self.segment_size, size - offset))
+            for index, offset in enumerate(range(0, size, self.segment_size))
+            if str(index) not in state["done"]
+        ]
+        if state["done"]:
+            logger.info("Resuming %s: %s segments already on disk.", url, len(state["done"]))
+
+        semaphore = asyncio.Semaphore(self.connections)
+        with path.open("r+b") as f:
+
+            async def fetch(index, offset, length):
+                async with semaphore:
+                    state["done"][str(index)] = await self._fetch_segment(
+                        url, f, offset, length, validator
+                    )
+                    self._save_state(path, state)
+
+            # Let every segment finish or fail so as much progress as possible is kept
+            results = await asyncio.gather(
+                *(fetch(*segment) for segment in segments), return_exceptions=True
+            )
+        # Every segment checks its own length, so the file is complete once none failed
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+
+        with helpers.metrics.STAGE_SECONDS.time(stage="hash"):
+            exe_hash = await helpers.workers.run_in_worker(helpers.workers.hash_file, path)
+        if expected_hash and exe_hash != expected_hash:
+            path.unlink()
+            self.sidecar_path(path).unlink(missing_ok=True)
+            raise ValueError(f"Downloaded file hash {exe_hash} does not match {expected_hash}")
+
+        self.sidecar_path(path).unlink(missing_ok=True)
+        return exe_hash, size
+
+    async def _load_state(self, url, path, size, validator):
+        sidecar = self.sidecar_path(path)
+        state = None
+        if sidecar.exists() and path.exists():
+            try:
+                state = json.loads(sidecar.read_text())
+            except ValueError:
+                state = None
+        if state and (state["url"], state["size"], state["validator"], state["segment_size"]) == (
+            url,
+            size,
+            validator,
+            self.segment_size,
+        ):
+            # Do not trust segments whose bytes no longer match what was recorded
+            for index, segment_hash in list(state["done"].items()):
+                offset = int(index) * self.segment_size
+                length = min(self.segment_size, size - offset)
+                if (
+                    await helpers.workers.run_in_worker(_hash_range, path, offset, length)
+                    != segment_hash
+                ):
+                    del state["done"][index]
+            return state
+
+        with path.open("wb") as f:
+            f.truncate(size)
+        state = {
+            "url": url,
+            "size": size,
+            "validator": validator,
+            "segment_size": self.segment_size,
+            "done": {},
+        }
+        self._save_state(path, state)
+        return state
+
+    def _save_state(self, path, state):
+        sidecar = self.sidecar_path(path)
+        temp_path = sidecar.with_name(sidecar.name + ".tmp")
+        temp_path.write_text(json.dumps(state))
+        os.replace(temp_path, sidecar)
+
+    async def _fetch_segment(self, url, f, offset, length, validator):
+        headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+        if validator:
+            # Fail instead of mixing bytes from two different files
+            headers["If-Range"] = validator
+        # retries counts the attempts after the first, so 0 still fetches the segment once
+        attempts = self.retries + 1
+        for attempt in range(1, attempts + 1):
+            hash_object = hashlib.sha256()
+            received = 0
+            try:
+                async with self.session.get(url, headers=headers) as response:
+                    if response.status != 206:
+                        raise ValueError(f"Expected 206 for a range request, got {response.status}")
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        if received + len(chunk) > length:
+                            raise ValueError("Server sent more bytes than requested")
+                        await self.limiter.consume(len(chunk))
+                        f.seek(offset + received)
+                        f.write(chunk)
+                        hash_object.update(chunk)
+                        received += len(chunk)
+                if received != length:
+                    raise ValueError(f"Segment at {offset} ended after {received} of {length} bytes")
+                return hash_object.hexdigest()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if attempt == attempts:
+                    raise
+                logger.warning(
+                    "Segment at %s failed (attempt %s/%s): %s", offset, attempt, attempts, e
+                )
+                await asyncio.sleep(2 ** attempt * 0.5)
@@ -0,0 +1,45 @@
+import logging
+import aiohttp
+import settings
+
+logger = logging.getLogger(__name__)
+
+
+def create_session():
+    # One long-lived session per bot so every fetcher reuses pooled TCP/TLS connections
+    connector = aiohttp.TCPConnector(
+        limit=settings.HTTP_POOL_SIZE,
+        ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+    )
+    # No total timeout so large downloads are not cut off; stalled reads still fail
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=settings.HTTP_CONNECT_TIMEOUT,
+        sock_read=settings.HTTP_READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+class ConditionalFetcher:
+    # Sends If-None-Match for URLs it has seen before and serves the cached body on 304
+
+    def __init__(self):
+        self._cache = {}
+
+    async def get_text(self, session: aiohttp.ClientSession, url: str) -> str:
+        headers = {}
+        cached = self._cache.get(url)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and cached:
+                logger.debug("%s not modified (ETag %s).", url, cached[0])
+                return cached[1]
+            response.raise_for_status()
+            text = await response.text()
+            etag = response.headers.get("ETag")
+            if etag:
+                self._cache[url] = (etag, text)
+            return text
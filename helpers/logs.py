@@ -0,0 +1,96 @@
+import atexit
+import contextlib
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+
+# Log records are handed to a queue on the calling thread and formatted and written by
+# one listener thread, so a slow disk never stalls the event loop.
+
+# Fields copied onto records while they are set, e.g. the version being downloaded
+CONTEXT_FIELDS = ("realm", "version", "stage")
+_context = contextvars.ContextVar("log_context", default={})
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    # Tag every record logged inside the block, including from tasks it starts
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    # One JSON object per line with the context fields as keys of their own
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # Enqueues records unformatted; the listener renders them with the target handlers
+
+    def __init__(self, log_queue, route: int):
+        super().__init__(log_queue)
+        self.route = route
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread. Arguments are captured by reference,
+        # which is safe for the immutable values logged here.
+        record = logging.makeLogRecord(record.__dict__)
+        record.log_route = self.route
+        for name, value in _context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return record
+
+
+class _Listener(logging.handlers.QueueListener):
+    # Sends each record only to the handlers of the logger it was logged to
+
+    def __init__(self, log_queue, routes):
+        super().__init__(log_queue, respect_handler_level=True)
+        self.routes = routes
+
+    def handle(self, record):
+        for handler in self.routes[record.log_route]:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def use_queue(logger_names):
+    # Move the handlers configured for these loggers behind a queue and start the listener
+    log_queue = queue.SimpleQueue()
+    routes = []
+    for name in logger_names:
+        logger = logging.getLogger(name)
+        handlers = list(logger.handlers)
+        if not handlers:
+            continue
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(_QueueHandler(log_queue, len(routes)))
+        routes.append(handlers)
+
+    listener = _Listener(log_queue, routes)
+    listener.start()
+    # Flush what is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,72 @@
+import bisect
+import logging
+from helpers.database import db
+
+logger = logging.getLogger(__name__)
+
+# Autocomplete is answered from memory; the commands themselves query the indexes.
+MAX_SUGGESTIONS = 25
+
+
+class PrefixIndex:
+    # Sorted, de-duplicated keys; a prefix lookup is a bisect plus a short scan
+
+    def __init__(self):
+        self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key: str):
+        position = bisect.bisect_left(self._keys, key)
+        if position == len(self._keys) or self._keys[position] != key:
+            self._keys.insert(position, key)
+
+    def replace(self, keys):
+        self._keys = sorted(set(keys))
+
+    def complete(self, prefix: str, limit: int = MAX_SUGGESTIONS):
+        position = bisect.bisect_left(self._keys, prefix)
+        matches = []
+        for key in self._keys[position : position + limit]:
+            if not key.startswith(prefix):
+                break
+            matches.append(key)
+        return matches
+
+
+versions = PrefixIndex()
+exe_hashes = PrefixIndex()
+
+
+async def load():
+    # Fill the indexes from the database; called at startup and after tables are cleared
+    versions.replace(
+        version for (version,) in await db.fetchall("SELECT DISTINCT version FROM artifact")
+    )
+    exe_hashes.replace(
+        exe_hash for (exe_hash,) in await db.fetchall("SELECT DISTINCT exe_hash FROM artifact")
+    )
+    logger.debug(
+        "Loaded %s versions and %s exe hashes for autocomplete.", len(versions), len(exe_hashes)
+    )
+
+
+def record(version: str, hashes):
+    # Keep the indexes in sync with a version the downloader just committed
+    versions.add(version)
+    for exe_hash in hashes:
+        exe_hashes.add(exe_hash)
+
+
+def glob_prefix(pattern: str) -> str:
+    # Literal part of a GLOB pattern before its first wildcard
+    for position, char in enumerate(pattern):
+        if char in "*?[":
+            return pattern[:position]
+    return pattern
+
+
+def prefix_range(prefix: str):
+    # (low, high) bounds so `column >= low AND column < high` matches the prefix with an index seek
+    return prefix, prefix + "\uffff"
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    # Measures event-loop stall by checking how late a periodic sleep wakes up.
+
+    def __init__(self, interval: float = 0.1, warn_threshold: float = 1.0):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.samples = 0
+
+    def reset(self):
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.samples = 0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - start - self.interval)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self.samples += 1
+            if self.last_lag >= self.warn_threshold:
+                logger.warning("Event loop stalled for %.3fs.", self.last_lag)
+
+
+async def measure_lag(coro, interval: float = 0.01):
+    # Run coro while sampling loop lag; returns (result, max_lag, elapsed)
+    monitor = LoopLagMonitor(interval=interval, warn_threshold=float("inf"))
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    try:
+        result = await coro
+    finally:
+        elapsed = time.perf_counter() - start
+        # Let the monitor wake up once more so a stall at the very end is counted
+        await asyncio.sleep(interval * 2)
+        task.cancel()
+    return result, monitor.max_lag, elapsed
@@ -0,0 +1,210 @@
+import bisect
+import contextlib
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+# Minimal Prometheus text-format instrumentation; no client library needed.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self):
+        # (suffix, label values, extra labels, value)
+        for key, value in self._values.items():
+            yield "", key, (), value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(self.label_names, key, extra)} {_format_value(value)}"
+            )
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels=()):
+        super().__init__(name, help, labels)
+        self._function = None
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        # Read the value when scraped, e.g. the current queue depth
+        self._function = function
+
+    def samples(self):
+        if self._function is not None:
+            yield "", (), (), self._function()
+        else:
+            yield from super().samples()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._values[key] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", key, (("le", _format_value(bound)),), cumulative
+            yield "_sum", key, (), total
+            yield "_count", key, (), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+POLLS = registry.counter(
+    "poe_patch_polls_total", "Version polls by outcome (changed, unchanged, no_agreement, failed)", ("realm", "result")
+)
+STAGE_SECONDS = registry.histogram(
+    "poe_pipeline_stage_seconds",
+    "Time spent in each pipeline stage",
+    ("stage",),
+)
+DOWNLOADED_BYTES = registry.counter(
+    "poe_downloaded_bytes_total", "Bytes of exes downloaded from the CDN", ("realm",)
+)
+STORED_BYTES = registry.counter(
+    "poe_stored_bytes_total", "Bytes of archives written to the blob store", ("kind",)
+)
+NOTIFICATIONS = registry.counter(
+    "poe_notifications_total", "Notification attempts by outcome (sent, failed)", ("result",)
+)
+DETECTION_TO_ANNOUNCE_SECONDS = registry.histogram(
+    "poe_detection_to_announce_seconds",
+    "Time from committing a new version to announcing it",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+LOOP_LAG_SECONDS = registry.gauge("poe_event_loop_lag_seconds", "Most recent event loop lag")
+LOOP_LAG_MAX_SECONDS = registry.gauge("poe_event_loop_lag_max_seconds", "Largest event loop lag seen")
+QUEUE_DEPTH = registry.gauge("poe_notification_queue_depth", "Notifications waiting to be sent")
+OLDEST_PENDING_SECONDS = registry.gauge(
+    "poe_oldest_pending_notification_seconds",
+    "Age of the oldest version that has been committed but not announced",
+)
+
+
+class MetricsServer:
+    # Serves registry.render() on http://host:port/metrics
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108, metrics: Registry = registry):
+        self.host = host
+        self.port = port
+        self.metrics = metrics
+        self._runner = None
+
+    async def _handle(self, request):
+        from aiohttp import web
+
+        return web.Response(
+            body=self.metrics.render().encode(), headers={"Content-Type": CONTENT_TYPE}
+        )
+
+    async def start(self):
+        # aiohttp.web is imported on first start; it is slow to import and optional
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+        logger.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,187 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Numbered schema migrations. The applied number is kept in PRAGMA user_version.
+# A step is either an SQL string or a callable taking the connection.
+# Never edit a migration once released; append a new one instead.
+MIGRATIONS = [
+    (
+        1,
+        "Create patch and message_log tables",
+        [
+            """CREATE TABLE IF NOT EXISTS patch (
+                     version TEXT,
+                     exe_hash TEXT,
+                     unix_time INTEGER)""",
+            """CREATE TABLE IF NOT EXISTS message_log (
+                     id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     version TEXT,
+                     sent BOOLEAN,
+                     unix_time_sent INTEGER,
+                     unix_time_logged INTEGER)""",
+        ],
+    ),
+    (
+        2,
+        "Remove duplicate versions and add indexes",
+        [
+            "DELETE FROM patch WHERE rowid NOT IN (SELECT MIN(rowid) FROM patch GROUP BY version)",
+            # Keep one notification per version; drop unsent duplicates
+            "DELETE FROM message_log WHERE sent = 0 AND id NOT IN (SELECT MIN(id) FROM message_log GROUP BY version)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_patch_version ON patch (version)",
+            "CREATE INDEX IF NOT EXISTS idx_patch_exe_hash ON patch (exe_hash)",
+            "CREATE INDEX IF NOT EXISTS idx_message_log_unsent ON message_log (sent) WHERE sent = 0",
+        ],
+    ),
+    (
+        3,
+        "Track stored archives by exe hash",
+        [
+            """CREATE TABLE IF NOT EXISTS blob (
+                     exe_hash TEXT PRIMARY KEY,
+                     size INTEGER,
+                     unix_time INTEGER,
+                     upload_message_url TEXT,
+                     attachment_url TEXT)""",
+        ],
+    ),
+    (
+        4,
+        "Record how each blob is stored",
+        [
+            "ALTER TABLE blob ADD COLUMN kind TEXT NOT NULL DEFAULT 'full'",
+            "ALTER TABLE blob ADD COLUMN base_hash TEXT",
+            "ALTER TABLE blob ADD COLUMN chain_length INTEGER NOT NULL DEFAULT 0",
+        ],
+    ),
+    (
+        5,
+        "Record the codec of each blob",
+        [
+            "ALTER TABLE blob ADD COLUMN codec TEXT",
+            "UPDATE blob SET codec = 'deflate' WHERE kind = 'full'",
+        ],
+    ),
+    (
+        6,
+        "Track every downloaded file of a version",
+        [
+            """CREATE TABLE IF NOT EXISTS artifact (
+                     id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     version TEXT NOT NULL,
+                     name TEXT NOT NULL,
+                     exe_hash TEXT NOT NULL,
+                     size INTEGER,
+                     unix_time INTEGER)""",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_artifact_version_name ON artifact (version, name)",
+            "CREATE INDEX IF NOT EXISTS idx_artifact_exe_hash ON artifact (exe_hash)",
+            "CREATE INDEX IF NOT EXISTS idx_artifact_name_time ON artifact (name, unix_time)",
+            """INSERT INTO artifact (version, name, exe_hash, unix_time)
+                     SELECT version, 'PathOfExile.exe', exe_hash, unix_time FROM patch ORDER BY unix_time""",
+        ],
+    ),
+    (
+        7,
+        "Scope versions, artifacts and messages by realm",
+        [
+            # Existing rows all belong to the original Path of Exile realm
+            "ALTER TABLE patch ADD COLUMN realm TEXT NOT NULL DEFAULT 'poe'",
+            "ALTER TABLE message_log ADD COLUMN realm TEXT NOT NULL DEFAULT 'poe'",
+            "ALTER TABLE artifact ADD COLUMN realm TEXT NOT NULL DEFAULT 'poe'",
+            "DROP INDEX IF EXISTS idx_patch_version",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_patch_realm_version ON patch (realm, version)",
+            "DROP INDEX IF EXISTS idx_artifact_version_name",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_artifact_realm_version_name ON artifact (realm, version, name)",
+            "DROP INDEX IF EXISTS idx_artifact_name_time",
+            "CREATE INDEX IF NOT EXISTS idx_artifact_realm_name_time ON artifact (realm, name, unix_time)",
+        ],
+    ),
+    (
+        8,
+        "Record PE headers and sections of every exe",
+        [
+            """CREATE TABLE IF NOT EXISTS pe_image (
+                     exe_hash TEXT PRIMARY KEY,
+                     machine INTEGER,
+                     timestamp INTEGER,
+                     file_version TEXT,
+                     product_version TEXT,
+                     unix_time INTEGER)""",
+            """CREATE TABLE IF NOT EXISTS pe_section (
+                     exe_hash TEXT NOT NULL,
+                     idx INTEGER NOT NULL,
+                     name TEXT NOT NULL,
+                     virtual_address INTEGER,
+                     virtual_size INTEGER,
+                     raw_size INTEGER,
+                     sha256 TEXT,
+                     PRIMARY KEY (exe_hash, idx)) WITHOUT ROWID""",
+        ],
+    ),
+    (
+        9,
+        "Index artifact versions and times for lookups",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_artifact_version ON artifact (version)",
+            "CREATE INDEX IF NOT EXISTS idx_artifact_unix_time ON artifact (unix_time)",
+        ],
+    ),
+    (
+        10,
+        "Index patch times for keyset pagination",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_patch_unix_time ON patch (unix_time)",
+            "CREATE INDEX IF NOT EXISTS idx_patch_realm_time ON patch (realm, unix_time)",
+        ],
+    ),
+    (
+        11,
+        "Record the storage tier of each blob",
+        [
+            "ALTER TABLE blob ADD COLUMN tier TEXT NOT NULL DEFAULT 'hot'",
+        ],
+    ),
+    (
+        12,
+        "Track integrity checks of stored exes",
+        [
+            """CREATE TABLE IF NOT EXISTS scrub (
+                     exe_hash TEXT PRIMARY KEY,
+                     checked_at INTEGER,
+                     status TEXT NOT NULL,
+                     detail TEXT)""",
+            "CREATE INDEX IF NOT EXISTS idx_scrub_problems ON scrub (status) WHERE status != 'ok'",
+        ],
+    ),
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    # Apply every pending migration, each in its own transaction.
+    # The connection must be in autocommit mode (isolation_level=None).
+    current = schema_version(conn)
+    applied = []
+    for number, description, steps in MIGRATIONS:
+        if number <= current:
+            continue
+        logger.info("Applying database migration %s: %s", number, description)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            logger.error("Database migration %s failed; rolled back.", number)
+            raise
+        applied.append(number)
+    return applied
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+import helpers.metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Notification:
+    message_id: int
+    realm: str
+    version: str
+    # Unix time the message_log row was committed
+    logged_at: int
+    queued_at: float = field(default_factory=time.time)
+
+
+class NotificationQueue:
+    # Hands committed versions from the downloader to the notifier without polling the database
+
+    def __init__(self):
+        self._queue = asyncio.Queue()
+        # message_id -> unix time the row was committed
+        self._pending = {}
+        self.sent_count = 0
+        self.failed_count = 0
+        # Stage name -> seconds taken by the most recent notification
+        self.stage_latency = {}
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def put(self, message_id: int, realm: str, version: str, logged_at: int) -> bool:
+        # Ignore rows that are already queued, e.g. found by the startup scan and the downloader
+        if message_id in self._pending:
+            return False
+        self._pending[message_id] = logged_at
+        self._queue.put_nowait(Notification(message_id, realm, version, logged_at))
+        return True
+
+    async def get(self, timeout: float = None) -> Notification:
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    def done(self, notification: Notification, sent: bool):
+        self._pending.pop(notification.message_id, None)
+        if sent:
+            self.sent_count += 1
+        else:
+            self.failed_count += 1
+        helpers.metrics.NOTIFICATIONS.inc(result="sent" if sent else "failed")
+
+    def record_stage(self, stage: str, seconds: float):
+        self.stage_latency[stage] = seconds
+        helpers.metrics.STAGE_SECONDS.observe(seconds, stage=stage)
+        logger.debug("Notification stage '%s' took %.3fs.", stage, seconds, extra={"stage": stage})
+
+    def oldest_pending_age(self) -> float:
+        # Seconds since the oldest queued version was committed, 0 when nothing is waiting
+        if not self._pending:
+            return 0.0
+        return max(0.0, time.time() - min(self._pending.values()))
+
+    def status(self) -> str:
+        response = f"Pending notifications: {self.pending_count}\n"
+        response += f"Sent: {self.sent_count}, failed attempts: {self.failed_count}\n"
+        for stage, seconds in self.stage_latency.items():
+            response += f"{stage}: {seconds:.2f}s\n"
+        return response
@@ -1,8 +1,109 @@
 import discord
+from collections import OrderedDict
 from typing import Callable, Optional
 import time
 
 
+class PageCache:
+    # Rendered pages shared by every view of the same listing, newest used kept.
+    # Cleared by the downloader whenever it inserts a row.
+
+    def __init__(self, max_pages: int = 256):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+
+    def get(self, key):
+        value = self._pages.get(key)
+        if value is not None:
+            self._pages.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._pages[key] = value
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.max_pages:
+            self._pages.popitem(last=False)
+
+    def invalidate(self):
+        self._pages.clear()
+
+
+page_cache = PageCache()
+
+
+class KeysetPageSource:
+    # Lazy page source for Pagination. Pages are fetched with keyset queries relative
+    # to a neighbouring page's first or last key, so a page costs O(per_page) however
+    # deep it is. Rows must come with a unique, ordered key (e.g. (unix_time, rowid)).
+    #   fetch_older(key, limit): rows after key in display order (key None: from the start)
+    #   fetch_newer(key, limit): rows before key, nearest first (key None: from the end)
+    #   count(): total number of rows
+    #   render(rows, page_index, total_pages): embed for a page
+
+    def __init__(
+        self,
+        name: str,
+        fetch_older: Callable,
+        fetch_newer: Callable,
+        count: Callable,
+        render: Callable,
+        key: Callable,
+        per_page: int = 15,
+        cache: PageCache = page_cache,
+    ):
+        self.name = name
+        self.fetch_older = fetch_older
+        self.fetch_newer = fetch_newer
+        self.count = count
+        self.render = render
+        self.key = key
+        self.per_page = per_page
+        self.cache = cache
+
+    async def _totals(self):
+        # (total_pages, total_rows)
+        total = self.cache.get((self.name, "count"))
+        if total is None:
+            total = await self.count()
+            self.cache.put((self.name, "count"), total)
+        return max(1, Pagination.compute_total_pages(total, self.per_page)), total
+
+    async def get_page(self, page_index: int):
+        total_pages, total = await self._totals()
+        page_index = min(max(page_index, 1), total_pages)
+        page = self.cache.get((self.name, page_index))
+        if page is None:
+            page = await self._load(page_index, total_pages, total)
+        return page[0].copy(), total_pages
+
+    async def _load(self, page_index, total_pages, total):
+        previous = self.cache.get((self.name, page_index - 1))
+        following = self.cache.get((self.name, page_index + 1))
+        if page_index == 1:
+            rows = await self.fetch_older(None, self.per_page)
+        elif previous:
+            rows = await self.fetch_older(previous[2], self.per_page)
+        elif following:
+            rows = list(reversed(await self.fetch_newer(following[1], self.per_page)))
+        elif page_index == total_pages:
+            last_page_size = total - (total_pages - 1) * self.per_page
+            rows = list(reversed(await self.fetch_newer(None, last_page_size)))
+        else:
+            # No neighbour cached (evicted); walk from the nearest cached page before it
+            start = page_index - 1
+            while start > 1 and self.cache.get((self.name, start)) is None:
+                start -= 1
+            for index in range(start, page_index):
+                if self.cache.get((self.name, index)) is None:
+                    await self._load(index, total_pages, total)
+            return await self._load(page_index, total_pages, total)
+
+        embed = self.render(rows, page_index, total_pages)
+        page = (embed, self.key(rows[0]), self.key(rows[-1])) if rows else (embed, None, None)
+        self.cache.put((self.name, page_index), page)
+        return page
+
+
 class Pagination(discord.ui.View):
     def __init__(
         self, interaction: discord.Interaction, get_page: Callable, timeout: int = 100
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import struct
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+# Request: opcode 1, protocol version 6
+REQUEST = bytes([1, 6])
+RESPONSE_OPCODE = 2
+# Opcode byte followed by 32 bytes we do not use
+HEADER_SIZE = 33
+
+
+@dataclass(frozen=True)
+class PatchServerResponse:
+    version: str
+    cdn_urls: list = field(default_factory=list)
+
+
+def encode_response(urls):
+    # Serialise a reply the way patch.pathofexile.com does; used by the local stand-in
+    body = bytes([RESPONSE_OPCODE]) + bytes(HEADER_SIZE - 1)
+    for url in urls:
+        body += struct.pack(">H", len(url)) + url.encode("utf-16le")
+    return body
+
+
+def version_from_url(url):
+    # "https://patch.poecdn.com/3.25.1.2/" -> "3.25.1.2"
+    return url.rstrip("/").split("/")[-1]
+
+
+class PatchServerClient:
+    def __init__(
+        self,
+        host: str = "patch.pathofexile.com",
+        port: int = 12995,
+        connect_timeout: float = 5,
+        read_timeout: float = 5,
+        url_count: int = 2,
+        keep_alive: bool = True,
+    ):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.url_count = url_count
+        self.keep_alive = keep_alive
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def fetch(self) -> PatchServerResponse:
+        async with self._lock:
+            reused = self._writer is not None
+            try:
+                return await self._request()
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                if not reused:
+                    raise
+                # The server may have dropped an idle connection; try once on a fresh one
+                logger.debug("Patch server connection went stale, reconnecting.")
+                return await self._request()
+            finally:
+                if not self.keep_alive:
+                    await self._disconnect()
+
+    async def close(self):
+        async with self._lock:
+            await self._disconnect()
+
+    async def _request(self):
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.connect_timeout
+            )
+        try:
+            self._writer.write(REQUEST)
+            await asyncio.wait_for(self._writer.drain(), self.read_timeout)
+            return await asyncio.wait_for(self._read_response(), self.read_timeout)
+        except BaseException:
+            # A failed or cancelled request can leave its reply in flight, which the next
+            # request on this connection would read as its own answer
+            await self._disconnect()
+            raise
+
+    async def _read_response(self):
+        header = await self._reader.readexactly(HEADER_SIZE)
+        if header[0] != RESPONSE_OPCODE:
+            raise ValueError(f"Unexpected patch server opcode {header[0]}")
+
+        urls = []
+        for _ in range(self.url_count):
+            (length,) = struct.unpack(">H", await self._reader.readexactly(2))
+            urls.append((await self._reader.readexactly(length * 2)).decode("utf-16le"))
+
+        return PatchServerResponse(version=version_from_url(urls[0]), cdn_urls=urls)
+
+    async def _disconnect(self):
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
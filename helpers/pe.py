@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import mmap
+import struct
+from dataclasses import dataclass, field
+import helpers.workers
+
+logger = logging.getLogger(__name__)
+
+# Parses the PE headers of a Windows executable straight out of a memory map;
+# headers are read with struct.unpack_from and sections hashed through a memoryview,
+# so nothing but the parsed fields is copied out of the file.
+
+RT_VERSION = 16
+RESOURCE_DIRECTORY = 2
+FIXED_FILE_INFO_SIGNATURE = struct.pack("<I", 0xFEEF04BD)
+
+
+class PeFormatError(ValueError):
+    pass
+
+
+@dataclass
+class PeSection:
+    index: int
+    name: str
+    virtual_address: int
+    virtual_size: int
+    raw_size: int
+    sha256: str
+
+
+@dataclass
+class PeInfo:
+    machine: int
+    # TimeDateStamp of the COFF header, seconds since the epoch
+    timestamp: int
+    file_version: str = None
+    product_version: str = None
+    sections: list = field(default_factory=list)
+
+
+def _version_string(most_significant, least_significant):
+    return (
+        f"{most_significant >> 16}.{most_significant & 0xFFFF}."
+        f"{least_significant >> 16}.{least_significant & 0xFFFF}"
+    )
+
+
+def _rva_to_offset(sections, rva):
+    for _, virtual_address, virtual_size, raw_size, raw_pointer in sections:
+        if virtual_address <= rva < virtual_address + max(virtual_size, raw_size):
+            return rva - virtual_address + raw_pointer
+    raise PeFormatError(f"RVA {rva:#x} is outside every section")
+
+
+def _find_version_resource(view, sections, rsrc_offset):
+    # Walk type -> name -> language, taking the first entry below RT_VERSION
+    directory = rsrc_offset
+    wanted = RT_VERSION
+    for _ in range(3):
+        named, numbered = struct.unpack_from("<HH", view, directory + 12)
+        for entry in range(named + numbered):
+            entry_id, target = struct.unpack_from("<II", view, directory + 16 + entry * 8)
+            if wanted is None or (not entry_id & 0x80000000 and entry_id == wanted):
+                break
+        else:
+            return None
+        wanted = None
+        if not target & 0x80000000:
+            break
+        directory = rsrc_offset + (target & 0x7FFFFFFF)
+    data_rva, size = struct.unpack_from("<II", view, rsrc_offset + (target & 0x7FFFFFFF))
+    return _rva_to_offset(sections, data_rva), size
+
+
+def _parse_view(view):
+    if view[:2] != b"MZ":
+        raise PeFormatError("Missing MZ header")
+    (pe_offset,) = struct.unpack_from("<I", view, 0x3C)
+    if view[pe_offset : pe_offset + 4] != b"PE\0\0":
+        raise PeFormatError("Missing PE signature")
+
+    machine, section_count, timestamp, _, _, optional_size, _ = struct.unpack_from(
+        "<HHIIIHH", view, pe_offset + 4
+    )
+    optional = pe_offset + 24
+    (magic,) = struct.unpack_from("<H", view, optional)
+    if magic == 0x10B:
+        directories = optional + 96
+    elif magic == 0x20B:
+        directories = optional + 112
+    else:
+        raise PeFormatError(f"Unknown optional header magic {magic:#x}")
+    (directory_count,) = struct.unpack_from("<I", view, directories - 4)
+
+    info = PeInfo(machine=machine, timestamp=timestamp)
+    raw_sections = []
+    table = optional + optional_size
+    for index in range(section_count):
+        name, virtual_size, virtual_address, raw_size, raw_pointer = struct.unpack_from(
+            "<8sIIII", view, table + index * 40
+        )
+        raw_sections.append((name, virtual_address, virtual_size, raw_size, raw_pointer))
+        info.sections.append(
+            PeSection(
+                index=index,
+                name=name.rstrip(b"\0").decode("ascii", "replace"),
+                virtual_address=virtual_address,
+                virtual_size=virtual_size,
+                raw_size=raw_size,
+                sha256=hashlib.sha256(view[raw_pointer : raw_pointer + raw_size]).hexdigest(),
+            )
+        )
+
+    if directory_count > RESOURCE_DIRECTORY:
+        rsrc_rva, rsrc_size = struct.unpack_from("<II", view, directories + RESOURCE_DIRECTORY * 8)
+        if rsrc_rva and rsrc_size:
+            resource = _find_version_resource(
+                view, raw_sections, _rva_to_offset(raw_sections, rsrc_rva)
+            )
+            if resource:
+                offset, size = resource
+                fixed = view.obj.find(FIXED_FILE_INFO_SIGNATURE, offset, offset + size)
+                if fixed != -1:
+                    file_ms, file_ls, product_ms, product_ls = struct.unpack_from(
+                        "<IIII", view, fixed + 8
+                    )
+                    info.file_version = _version_string(file_ms, file_ls)
+                    info.product_version = _version_string(product_ms, product_ls)
+    return info
+
+
+def parse_pe(path) -> PeInfo:
+    # Worker step: raises PeFormatError for files that are not PE images
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                return _parse_view(view)
+    except PeFormatError:
+        raise
+    except (struct.error, IndexError, ValueError) as e:
+        raise PeFormatError(f"Truncated or invalid PE image: {e}") from e
+
+
+async def analyze_exe(path):
+    # PeInfo of the exe, or None if it cannot be parsed; analysis never fails a download
+    try:
+        return await helpers.workers.run_in_worker(parse_pe, path)
+    except (PeFormatError, OSError) as e:
+        logger.warning("Could not parse PE headers of %s: %s", path, e)
+        return None
+
+
+def insert_statements(exe_hash: str, info: PeInfo, unix_time: int):
+    # (sql, params) pairs for Database.transaction; PE data is keyed by exe hash like blobs
+    statements = [
+        (
+            "INSERT OR IGNORE INTO pe_image (exe_hash, machine, timestamp, file_version, product_version, unix_time) VALUES (?, ?, ?, ?, ?, ?)",
+            (exe_hash, info.machine, info.timestamp, info.file_version, info.product_version, unix_time),
+        )
+    ]
+    for section in info.sections:
+        statements.append(
+            (
+                "INSERT OR IGNORE INTO pe_section (exe_hash, idx, name, virtual_address, virtual_size, raw_size, sha256) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    exe_hash,
+                    section.index,
+                    section.name,
+                    section.virtual_address,
+                    section.virtual_size,
+                    section.raw_size,
+                    section.sha256,
+                ),
+            )
+        )
+    return statements
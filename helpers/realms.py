@@ -0,0 +1,106 @@
+import json
+import logging
+import pathlib
+from dataclasses import dataclass, field
+import settings
+import helpers.patchserver
+import helpers.sources
+from helpers.scheduler import PollScheduler, parse_hot_windows
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REALM = "poe"
+GITHUB_LATEST_URL = "https://raw.githubusercontent.com/poe-tool-dev/latest-patch-version/main/latest.txt"
+
+
+@dataclass
+class Realm:
+    # One tracked patch endpoint (PoE 1, PoE 2, a test realm...). Every realm has its
+    # own poller and schedule; downloads, archives and notifications are shared.
+    name: str
+    title: str = "PathOfExile.exe"
+    patch_server_host: str = field(default_factory=lambda: settings.PATCH_SERVER_HOST)
+    patch_server_port: int = field(default_factory=lambda: settings.PATCH_SERVER_PORT)
+    github_url: str = None
+    sources: list = field(default_factory=lambda: ["direct"])
+    cdn_base_url: str = field(default_factory=lambda: settings.CDN_BASE_URL)
+    artifacts: list = field(default_factory=lambda: list(settings.ARTIFACTS))
+    channel_id: int = field(default_factory=lambda: settings.CHANNEL_ID)
+    channel_notifier_id: int = field(default_factory=lambda: settings.CHANNEL_NOTIFIER_ID)
+    notification_role: int = field(default_factory=lambda: settings.NOTIFICATION_ROLE)
+    poll_interval: float = field(default_factory=lambda: settings.TIME_INTERVAL_TO_DOWNLOAD)
+    poll_fast_interval: float = field(default_factory=lambda: settings.POLL_FAST_INTERVAL)
+    poll_hot_windows: str = field(default_factory=lambda: settings.POLL_HOT_WINDOWS)
+
+    def __post_init__(self):
+        if not self.name or not self.name.replace("_", "").replace("-", "").isalnum():
+            raise ValueError(f"Invalid realm name {self.name!r}")
+        if not self.artifacts:
+            raise ValueError(f"Realm {self.name} has no artifacts")
+        unknown = [source for source in self.sources if source not in helpers.sources.SOURCES]
+        if not self.sources or unknown:
+            raise ValueError(
+                f"Realm {self.name} sources must be some of {list(helpers.sources.SOURCES)}, "
+                f"got {self.sources}"
+            )
+        if settings.REQUIRE_SOURCE_AGREEMENT > len(self.sources):
+            raise ValueError(
+                f"Realm {self.name} has {len(self.sources)} sources, fewer than "
+                f"REQUIRE_SOURCE_AGREEMENT ({settings.REQUIRE_SOURCE_AGREEMENT})"
+            )
+        if self.poll_interval <= 0 or self.poll_fast_interval <= 0:
+            raise ValueError(f"Realm {self.name} poll intervals must be positive")
+        if "github" in self.sources and not self.github_url:
+            raise ValueError(f"Realm {self.name} uses the github source without a github_url")
+        self.cdn_base_url = self.cdn_base_url.rstrip("/")
+        self.patch_server_client = helpers.patchserver.PatchServerClient(
+            self.patch_server_host,
+            self.patch_server_port,
+            connect_timeout=settings.PATCH_SERVER_CONNECT_TIMEOUT,
+            read_timeout=settings.PATCH_SERVER_READ_TIMEOUT,
+        )
+        try:
+            hot_windows = parse_hot_windows(self.poll_hot_windows)
+        except ValueError as e:
+            raise ValueError(f"Realm {self.name}: {e}") from None
+        self.scheduler = PollScheduler(
+            base_interval=self.poll_interval,
+            fast_interval=self.poll_fast_interval,
+            max_interval=settings.POLL_MAX_INTERVAL,
+            burst_duration=settings.POLL_BURST_DURATION,
+            hot_windows=hot_windows,
+            jitter=settings.POLL_JITTER,
+        )
+
+    @property
+    def download_directory(self) -> pathlib.Path:
+        path = settings.DOWNLOAD_DIRECTORY / self.name
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+
+def default_realm():
+    # The single realm described by the top level settings, as before realms existed
+    return Realm(
+        name=DEFAULT_REALM,
+        github_url=GITHUB_LATEST_URL,
+        sources=list(settings.VERSION_SOURCES),
+    )
+
+
+def load_realms(path=None):
+    path = path or settings.REALMS_FILE
+    if not path:
+        return {DEFAULT_REALM: default_realm()}
+
+    entries = json.loads(pathlib.Path(path).read_text())
+    realms = {}
+    for entry in entries:
+        realm = Realm(**entry)
+        if realm.name in realms:
+            raise ValueError(f"Realm {realm.name} is configured more than once")
+        realms[realm.name] = realm
+    if not realms:
+        raise ValueError(f"{path} does not configure any realm")
+    logger.info("Loaded %s realms from %s: %s", len(realms), path, ", ".join(realms))
+    return realms
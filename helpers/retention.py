@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+import shutil
+import helpers.workers
+from helpers.blobstore import ARCNAME
+from helpers.codecs import CHUNK_SIZE, get_codec
+from helpers.database import db
+
+logger = logging.getLogger(__name__)
+
+
+# The steps below run in the worker pool and must stay picklable.
+
+
+def move_blob(source, codec, dest, exe_hash):
+    # Copy then rename, so a crash never leaves a truncated cold blob behind. Archives are
+    # verified against the exe hash; a delta needs its base for that, so its copy is
+    # compared with the hot blob instead. codec is None for deltas.
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = dest.with_name(dest.name + ".tmp")
+    try:
+        shutil.copyfile(source, temp_path)
+        if codec is None:
+            verified = helpers.workers.hash_file(temp_path) == helpers.workers.hash_file(source)
+        else:
+            verified = codec.verify(temp_path, ARCNAME, exe_hash)
+        if not verified:
+            raise ValueError(f"Cold copy of {exe_hash} failed verification")
+        os.replace(temp_path, dest)
+    finally:
+        temp_path.unlink(missing_ok=True)
+    return dest.stat().st_size
+
+
+def recompress_blob(source, source_codec, dest, dest_codec, exe_hash):
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    exe_path = dest.with_name(f"{exe_hash}.exe.tmp")
+    temp_path = dest.with_name(dest.name + ".tmp")
+    try:
+        with source_codec.open_member(source, ARCNAME) as member, open(exe_path, "wb") as f:
+            shutil.copyfileobj(member, f, CHUNK_SIZE)
+        dest_codec.compress(exe_path, temp_path, ARCNAME)
+        if not dest_codec.verify(temp_path, ARCNAME, exe_hash):
+            raise ValueError(f"Recompressed archive of {exe_hash} failed verification")
+        os.replace(temp_path, dest)
+    finally:
+        exe_path.unlink(missing_ok=True)
+        temp_path.unlink(missing_ok=True)
+    return dest.stat().st_size
+
+
+class RetentionManager:
+    # Keeps the hot tier under a byte budget. The newest keep_hot versions of every realm
+    # stay hot; other blobs go cold, least recently released first, optionally recompressed
+    # with cold_codec. Sizes come from the blob table, so no directory walk is needed.
+
+    def __init__(self, store, budget: int, keep_hot: int, cold_codec=None, io_rate: int = 0):
+        self.store = store
+        self.budget = budget
+        self.keep_hot = keep_hot
+        self.cold_codec = cold_codec
+        self.io_rate = io_rate
+
+    async def usage(self):
+        # {tier: (blob count, bytes)}
+        rows = await db.fetchall(
+            "SELECT tier, COUNT(*), COALESCE(SUM(size), 0) FROM blob "
+            "WHERE size IS NOT NULL GROUP BY tier"
+        )
+        return {tier: (count, size) for tier, count, size in rows}
+
+    async def candidates(self):
+        return await db.fetchall(
+            """WITH ranked AS (
+                     SELECT realm, version,
+                            ROW_NUMBER() OVER (PARTITION BY realm ORDER BY unix_time DESC) AS position
+                     FROM patch),
+                 keep AS (
+                     SELECT artifact.exe_hash FROM artifact
+                     JOIN ranked ON ranked.realm = artifact.realm AND ranked.version = artifact.version
+                     WHERE ranked.position <= ?)
+               SELECT blob.exe_hash, blob.kind, blob.codec, blob.size, MAX(artifact.unix_time) AS released
+               FROM blob LEFT JOIN artifact ON artifact.exe_hash = blob.exe_hash
+               WHERE blob.tier = 'hot' AND blob.size IS NOT NULL
+                 AND blob.exe_hash NOT IN (SELECT exe_hash FROM keep)
+               GROUP BY blob.exe_hash ORDER BY released""",
+            (self.keep_hot,),
+        )
+
+    async def enforce(self) -> int:
+        # Demote blobs until the hot tier fits the budget; returns how many were moved
+        hot_bytes = (await self.usage()).get("hot", (0, 0))[1]
+        if hot_bytes <= self.budget:
+            return 0
+
+        logger.info(
+            "Hot storage uses %s bytes, budget is %s. Demoting blobs.", hot_bytes, self.budget
+        )
+        moved = 0
+        for exe_hash, kind, codec, size, _ in await self.candidates():
+            if hot_bytes <= self.budget:
+                break
+            if await self.demote(exe_hash, kind, codec, size):
+                hot_bytes -= size
+                moved += 1
+        if hot_bytes > self.budget:
+            logger.warning(
+                "Hot storage still uses %s bytes; the newest %s versions do not fit the budget.",
+                hot_bytes,
+                self.keep_hot,
+            )
+        return moved
+
+    async def demote(self, exe_hash, kind, codec, size) -> bool:
+        source = self.store.path_for(exe_hash, kind, codec, "hot")
+        if not source.exists():
+            logger.warning("Blob %s is recorded as hot but %s is missing.", exe_hash, source)
+            return False
+
+        if kind == "full" and self.cold_codec and codec != self.cold_codec.name:
+            dest = self.store.path_for(exe_hash, kind, self.cold_codec.name, "cold")
+            new_size = await helpers.workers.run_in_worker(
+                recompress_blob, source, get_codec(codec), dest, self.cold_codec, exe_hash
+            )
+            new_codec = self.cold_codec.name
+        else:
+            dest = self.store.path_for(exe_hash, kind, codec, "cold")
+            new_size = await helpers.workers.run_in_worker(
+                move_blob, source, get_codec(codec) if kind == "full" else None, dest, exe_hash
+            )
+            new_codec = codec
+
+        # Record the new location before removing the hot copy
+        await db.execute(
+            "UPDATE blob SET tier = 'cold', codec = ?, size = ? WHERE exe_hash = ?",
+            (new_codec, new_size, exe_hash),
+        )
+        source.unlink()
+        logger.info("Moved blob %s to cold storage (%s -> %s bytes).", exe_hash, size, new_size)
+
+        if self.io_rate:
+            # Average the read and write traffic down to io_rate
+            await asyncio.sleep((size + new_size) / self.io_rate)
+        return True
+
+    async def run(self, interval: float):
+        while True:
+            try:
+                await self.enforce()
+            except Exception as e:
+                logger.error("Error in retention task: %s", e)
+            await asyncio.sleep(interval)
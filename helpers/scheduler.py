@@ -0,0 +1,86 @@
+import datetime
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+# Backoff stops doubling here; 2 ** 1024 overflows a float
+MAX_BACKOFF_EXPONENT = 32
+
+
+def parse_hot_windows(spec: str):
+    # "Tue 19:00-23:00, 18:00-20:00" -> [(1, 1140, 1380), (None, 1080, 1200)]
+    # Times are UTC minutes since midnight; a window may wrap past midnight.
+    windows = []
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        day, _, span = part.rpartition(" ")
+        day = day.strip()[:3].lower()
+        try:
+            weekday = WEEKDAYS.index(day) if day else None
+            bounds = [bound.split(":") for bound in span.split("-")]
+            start, end = (int(hours) * 60 + int(minutes) for hours, minutes in bounds)
+        except ValueError:
+            raise ValueError(f"Invalid hot window {part!r}, expected e.g. 'Tue 19:00-23:00'") from None
+        if not (0 <= start <= 1440 and 0 <= end <= 1440):
+            raise ValueError(f"Invalid hot window {part!r}, times must be within 00:00-24:00")
+        windows.append((weekday, start, end))
+    return windows
+
+
+class PollScheduler:
+    def __init__(
+        self,
+        base_interval: float,
+        fast_interval: float,
+        max_interval: float,
+        burst_duration: float,
+        hot_windows="",
+        jitter: float = 0.1,
+    ):
+        self.base_interval = base_interval
+        self.fast_interval = fast_interval
+        self.max_interval = max_interval
+        self.burst_duration = burst_duration
+        self.hot_windows = (
+            parse_hot_windows(hot_windows) if isinstance(hot_windows, str) else hot_windows
+        )
+        self.jitter = jitter
+        self.failures = 0
+        self.burst_until = 0.0
+
+    def record_success(self, changed: bool):
+        self.failures = 0
+        if changed:
+            # Hotfixes tend to follow a patch closely, so keep polling fast for a while
+            self.burst_until = time.monotonic() + self.burst_duration
+
+    def record_failure(self):
+        self.failures += 1
+
+    def in_hot_window(self, now: datetime.datetime = None):
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        minute = now.hour * 60 + now.minute
+        for weekday, start, end in self.hot_windows:
+            if start <= end:
+                if start <= minute < end and weekday in (None, now.weekday()):
+                    return True
+            elif minute >= start and weekday in (None, now.weekday()):
+                return True
+            elif minute < end and weekday in (None, (now.weekday() - 1) % 7):
+                return True
+        return False
+
+    @property
+    def current_interval(self) -> float:
+        if self.failures:
+            exponent = min(self.failures, MAX_BACKOFF_EXPONENT)
+            return min(self.max_interval, self.base_interval * 2**exponent)
+        if time.monotonic() < self.burst_until or self.in_hot_window():
+            return self.fast_interval
+        return self.base_interval
+
+    def next_delay(self) -> float:
+        interval = self.current_interval
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
@@ -0,0 +1,192 @@
+import asyncio
+import datetime
+import functools
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import settings
+import helpers.delta
+from helpers.blobstore import ARCNAME, blobs, load_chain
+from helpers.codecs import CHUNK_SIZE, get_codec
+from helpers.database import db
+
+logger = logging.getLogger(__name__)
+
+# Sleep this long when every exe was checked within the scrub interval
+IDLE_SLEEP = 3600
+
+
+class _Throttle:
+    # Blocking rate limit for a worker thread; 0 disables it
+
+    def __init__(self, bytes_per_second: int):
+        self.rate = bytes_per_second
+        self.started = time.monotonic()
+        self.consumed = 0
+
+    def consume(self, size: int):
+        if not self.rate:
+            return
+        self.consumed += size
+        ahead = self.consumed / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def _read_throttled(path, throttle):
+    data = bytearray()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            throttle.consume(len(chunk))
+            data += chunk
+    return bytes(data)
+
+
+def hash_archive(codec, path, rate):
+    # Stream the archive member through SHA-256
+    throttle = _Throttle(rate)
+    hash_object = hashlib.sha256()
+    with codec.open_member(path, ARCNAME) as member:
+        while chunk := member.read(CHUNK_SIZE):
+            throttle.consume(len(chunk))
+            hash_object.update(chunk)
+    return hash_object.hexdigest()
+
+
+def hash_delta(base_chain, store, delta_path, rate):
+    # Rebuild the base from its keyframe (base_chain as returned by load_chain), apply the
+    # stored delta and hash the result. Every read counts against the throttle.
+    throttle = _Throttle(rate)
+    keyframe_hash, kind, codec = base_chain[0]
+    if kind != "full":
+        raise ValueError(f"Delta chain does not start at a keyframe but at {keyframe_hash}")
+    data = bytearray()
+    with get_codec(codec).open_member(store.locate(keyframe_hash, kind, codec), ARCNAME) as member:
+        while chunk := member.read(CHUNK_SIZE):
+            throttle.consume(len(chunk))
+            data += chunk
+    base = bytes(data)
+    for link_hash, link_kind, _ in base_chain[1:]:
+        delta = _read_throttled(store.locate(link_hash, link_kind), throttle)
+        base = helpers.delta.apply_delta(base, delta)
+    target = helpers.delta.apply_delta(base, _read_throttled(delta_path, throttle))
+    throttle.consume(len(target))
+    return hashlib.sha256(target).hexdigest()
+
+
+class Scrubber:
+    # Re-hashes stored archives against their exe hash, oldest check first, one exe at a
+    # time. Results are written to the scrub table as they are produced, so the table is
+    # also the checkpoint: a restart continues with whatever was checked longest ago.
+    # Hashing runs on a dedicated thread so it never takes a pipeline worker.
+
+    def __init__(self, io_rate: int, interval: float):
+        self.io_rate = io_rate
+        self.interval = interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scrub")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def next_batch(self, limit: int = 10):
+        cutoff = int(time.time() - self.interval)
+        return await db.fetchall(
+            "SELECT artifact.exe_hash, MIN(artifact.version) FROM artifact "
+            "LEFT JOIN scrub ON scrub.exe_hash = artifact.exe_hash "
+            "WHERE scrub.checked_at IS NULL OR scrub.checked_at < ? "
+            "GROUP BY artifact.exe_hash ORDER BY MAX(scrub.checked_at) IS NOT NULL, MAX(scrub.checked_at) "
+            "LIMIT ?",
+            (cutoff, limit),
+        )
+
+    async def check(self, exe_hash: str, version: str):
+        # (status, detail) where status is "ok", "missing" or "corrupt"
+        found = blobs.find(exe_hash)
+        if found is None:
+            # Versions stored before the blob store
+            legacy_path = settings.STORAGE_DIRECTORY / f"{version}.zip"
+            if not legacy_path.exists():
+                return "missing", "No blob or legacy zip on disk"
+            found = legacy_path, "full", "deflate"
+
+        path, kind, codec = found
+        if kind == "delta":
+            row = await db.fetchone("SELECT base_hash FROM blob WHERE exe_hash = ?", (exe_hash,))
+            if row is None or row[0] is None:
+                return "missing", f"{path.name}: no blob row records the base of this delta"
+            try:
+                base_chain = await load_chain(row[0])
+            except LookupError:
+                return "missing", f"{path.name}: base {row[0]} has no blob row"
+            try:
+                actual = await self._run(hash_delta, base_chain, blobs, path, self.io_rate)
+            except Exception as e:
+                return "corrupt", f"{path.name}: {type(e).__name__}: {e}"
+        else:
+            try:
+                actual = await self._run(hash_archive, get_codec(codec), path, self.io_rate)
+            except Exception as e:
+                return "corrupt", f"{path.name}: {type(e).__name__}: {e}"
+        if actual != exe_hash:
+            return "corrupt", f"{path.name} contains {actual}"
+        return "ok", None
+
+    async def scrub_one(self, exe_hash: str, version: str):
+        status, detail = await self.check(exe_hash, version)
+        await db.execute(
+            "INSERT INTO scrub (exe_hash, checked_at, status, detail) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (exe_hash) DO UPDATE SET "
+            "checked_at = excluded.checked_at, status = excluded.status, detail = excluded.detail",
+            (exe_hash, int(datetime.datetime.now().timestamp()), status, detail),
+        )
+        if status != "ok":
+            logger.error(
+                "Integrity check of %s (version %s) failed: %s, %s",
+                exe_hash,
+                version,
+                status,
+                detail,
+            )
+        else:
+            logger.debug("Integrity check of %s passed.", exe_hash)
+        return status
+
+    async def problems(self):
+        # (exe_hash, status, detail, checked_at, "realm version, ...", first version)
+        return await db.fetchall(
+            "SELECT scrub.exe_hash, scrub.status, scrub.detail, scrub.checked_at, "
+            "(SELECT GROUP_CONCAT(realm || ' ' || version, ', ') FROM artifact "
+            " WHERE artifact.exe_hash = scrub.exe_hash), "
+            "(SELECT MIN(version) FROM artifact WHERE artifact.exe_hash = scrub.exe_hash) "
+            "FROM scrub WHERE status != 'ok' ORDER BY checked_at DESC"
+        )
+
+    async def summary(self):
+        # {status: count}, plus "unchecked"
+        rows = await db.fetchall("SELECT status, COUNT(*) FROM scrub GROUP BY status")
+        counts = dict(rows)
+        total = (await db.fetchone("SELECT COUNT(DISTINCT exe_hash) FROM artifact"))[0]
+        counts["unchecked"] = max(0, total - sum(counts.values()))
+        return counts
+
+    async def is_flagged(self, exe_hash: str) -> bool:
+        row = await db.fetchone("SELECT status FROM scrub WHERE exe_hash = ?", (exe_hash,))
+        return row is not None and row[0] != "ok"
+
+    async def run(self):
+        logger.info("Started Integrity Scrubber Task.")
+        while True:
+            try:
+                batch = await self.next_batch()
+                for exe_hash, version in batch:
+                    await self.scrub_one(exe_hash, version)
+            except Exception as e:
+                logger.error("Error in integrity scrubber: %s", e)
+                batch = None
+            if not batch:
+                await asyncio.sleep(IDLE_SLEEP)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
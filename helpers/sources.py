@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Source names a realm may poll; main.fetch_latest_version maps each to its fetcher
+SOURCES = ("direct", "github")
+
+
+@dataclass
+class ResolveResult:
+    version: Optional[str] = None
+    source: Optional[str] = None
+    # Seconds each source took to answer; sources cancelled before answering are absent
+    latencies: dict = field(default_factory=dict)
+    answers: dict = field(default_factory=dict)
+
+    @property
+    def disagreed(self) -> bool:
+        # Sources answered, but no version reached the required agreement
+        return self.version is None and any(map(is_valid_version, self.answers.values()))
+
+
+def is_valid_version(version):
+    return bool(version) and version.lower() != "none"
+
+
+async def resolve_version(
+    sources: dict, require_agreement: int = 1, timeout: float = None, is_new=None
+):
+    # Query every source concurrently and settle on the first version that
+    # `require_agreement` sources report. Slower sources are cancelled, except when
+    # the async `is_new` says the agreed version is already known: a lagging source
+    # must not mask a newer one, so the rest are awaited for a version that is new.
+    result = ResolveResult()
+    votes = Counter()
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def query(name, fetch):
+        try:
+            version = await fetch()
+        except Exception as e:
+            logger.error("Version source '%s' failed: %s", name, e)
+            version = None
+        result.latencies[name] = loop.time() - start
+        return name, version
+
+    tasks = {asyncio.create_task(query(name, fetch)) for name, fetch in sources.items()}
+    try:
+        for next_done in asyncio.as_completed(tasks, timeout=timeout):
+            name, version = await next_done
+            result.answers[name] = version
+            if not is_valid_version(version):
+                continue
+
+            votes[version] += 1
+            if votes[version] < require_agreement:
+                continue
+            if result.version is None:
+                result.version = version
+                result.source = name
+            if is_new is None or await is_new(version):
+                result.version = version
+                result.source = name
+                break
+    except asyncio.TimeoutError:
+        if result.version is None:
+            logger.warning("Version sources did not agree within %ss.", timeout)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if len(set(filter(is_valid_version, result.answers.values()))) > 1:
+        logger.warning("Version sources disagree: %s", result.answers)
+
+    return result
@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import logging
+import random
+import time
+import types
+from aiohttp import web
+import helpers.patchserver
+
+logger = logging.getLogger(__name__)
+
+
+class PatchServerStandIn:
+    # Local server speaking the patch.pathofexile.com:12995 protocol, for load tests.
+    # Change `version` at any time to simulate a patch going live.
+
+    def __init__(
+        self,
+        version: str = "3.25.0.1",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        cdn_bases=("https://patch.poecdn.com", "https://patch-poecdn.com"),
+        delay: float = 0,
+    ):
+        self.version = version
+        self.host = host
+        self.port = port
+        self.cdn_bases = cdn_bases
+        self.delay = delay
+        self.request_count = 0
+        self.connection_count = 0
+        self._server = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.debug("Patch server stand-in listening on %s:%s", self.host, self.port)
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        self.connection_count += 1
+        try:
+            while True:
+                request = await reader.readexactly(len(helpers.patchserver.REQUEST))
+                if request != helpers.patchserver.REQUEST:
+                    break
+                self.request_count += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                urls = [f"{base}/{self.version}/" for base in self.cdn_bases]
+                writer.write(helpers.patchserver.encode_response(urls))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+class CdnStandIn:
+    # Local aiohttp server serving files like patch.poecdn.com, with injectable faults:
+    # latency per request, a chance of a 500, a chance of cutting a body short, and
+    # an option to ignore Range headers.
+
+    def __init__(
+        self,
+        files: dict = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0,
+        error_rate: float = 0,
+        truncate_rate: float = 0,
+        support_ranges: bool = True,
+        seed: int = None,
+    ):
+        self.files = files if files is not None else {}
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.support_ranges = support_ranges
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self.bytes_sent = 0
+        self._runner = None
+
+    def url_for(self, path: str) -> str:
+        return f"http://{self.host}:{self.port}/{path.lstrip('/')}"
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        logger.debug("CDN stand-in listening on %s:%s", self.host, self.port)
+
+    async def close(self):
+        await self._runner.cleanup()
+
+    async def _handle(self, request):
+        self.request_count += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        data = self.files.get(request.match_info["path"])
+        if data is None:
+            return web.Response(status=404)
+
+        headers = {"ETag": f'"{hashlib.md5(data).hexdigest()}"'}
+        if self.support_ranges:
+            headers["Accept-Ranges"] = "bytes"
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(data))
+            return web.Response(status=200, headers=headers)
+
+        if self.random.random() < self.error_rate:
+            return web.Response(status=500)
+
+        status = 200
+        body = data
+        range_header = request.headers.get("Range")
+        if self.support_ranges and range_header and range_header.startswith("bytes="):
+            start, _, end = range_header[6:].partition("-")
+            start = int(start)
+            end = int(end) if end else len(data) - 1
+            body = data[start : end + 1]
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+
+        headers["Content-Length"] = str(len(body))
+        response = web.StreamResponse(status=status, headers=headers)
+        await response.prepare(request)
+        if self.random.random() < self.truncate_rate:
+            # Send part of the body and drop the connection
+            await response.write(body[: len(body) // 2])
+            self.bytes_sent += len(body) // 2
+            request.transport.close()
+            return response
+        await response.write(body)
+        self.bytes_sent += len(body)
+        await response.write_eof()
+        return response
+
+
+class ChannelSink:
+    # Stands in for a discord channel: records every message and answers uploads
+    # with fake attachment URLs. `wait_for` resolves when a matching message arrives.
+
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.messages = []
+        self._waiters = []
+
+    async def send(self, content=None, *, files=None, embed=None, **kwargs):
+        filenames = []
+        for file in files or []:
+            filenames.append(file.filename)
+            file.close()
+        message = types.SimpleNamespace(
+            id=len(self.messages) + 1,
+            content=content,
+            embed=embed,
+            filenames=filenames,
+            sent_at=time.perf_counter(),
+            jump_url=f"https://discord.invalid/channels/{self.id}/{len(self.messages) + 1}",
+            attachments=[
+                types.SimpleNamespace(
+                    filename=filename,
+                    url=f"https://cdn.discord.invalid/attachments/{self.id}/{filename}",
+                )
+                for filename in filenames
+            ],
+        )
+        self.messages.append(message)
+        for predicate, future in list(self._waiters):
+            if not future.done() and predicate(message):
+                future.set_result(message)
+        return message
+
+    async def wait_for(self, predicate, timeout: float = None):
+        for message in self.messages:
+            if predicate(message):
+                return message
+        future = asyncio.get_running_loop().create_future()
+        waiter = (predicate, future)
+        self._waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._waiters.remove(waiter)
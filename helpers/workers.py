@@ -0,0 +1,82 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile, ZIP_DEFLATED
+import settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        if settings.WORKER_POOL_TYPE == "process":
+            # Imported here: multiprocessing is slow to import and unused by thread pools
+            from concurrent.futures import ProcessPoolExecutor
+
+            _executor = ProcessPoolExecutor(max_workers=settings.WORKER_POOL_SIZE)
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.WORKER_POOL_SIZE, thread_name_prefix="pipeline"
+            )
+        logger.info(
+            "Started %s worker pool with %s workers.",
+            settings.WORKER_POOL_TYPE,
+            settings.WORKER_POOL_SIZE,
+        )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def run_in_worker(func, *args, **kwargs):
+    # Run a blocking pipeline step in the worker pool so the event loop keeps serving the gateway
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+# The steps below are plain module-level functions so a process pool can pickle them.
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    hash_object = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hash_object.update(chunk)
+    return hash_object.hexdigest()
+
+
+def compress_file(source_path, zip_path, arcname, compresslevel=9):
+    with ZipFile(zip_path, "w", ZIP_DEFLATED, compresslevel=compresslevel) as zipf:
+        zipf.write(source_path, arcname=arcname)
+    return zip_path.stat().st_size
+
+
+def extract_zip(zip_path, dest_path, chunk_size=CHUNK_SIZE):
+    # Write the single file in a zip, like the pre blob store {version}.zip archives, to dest_path
+    with ZipFile(zip_path, "r") as zipf, zipf.open(zipf.namelist()[0]) as member:
+        with open(dest_path, "wb") as f:
+            shutil.copyfileobj(member, f, chunk_size)
+
+
+def verify_zip(zip_path, arcname, expected_hash, chunk_size=CHUNK_SIZE):
+    hash_object = hashlib.sha256()
+    with ZipFile(zip_path, "r") as zipf:
+        with zipf.open(arcname) as member:
+            while chunk := member.read(chunk_size):
+                hash_object.update(chunk)
+    return hash_object.hexdigest() == expected_hash
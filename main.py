@@ -1,12 +1,32 @@
 import logging
-import aiohttp
 import asyncio
+import aiohttp
+import contextlib
 import datetime
-from zipfile import ZipFile, ZIP_DEFLATED
+import pathlib
+import time
+import zipfile
 import discord
 from discord.ext import commands
-import hashlib
 import settings
+import helpers.commandsync
+import helpers.download
+from helpers.blobstore import archive_path, blobs, cache, materialize, store_exe
+from helpers.codecs import get_codec
+from helpers.database import db
+import helpers.http
+import helpers.lookup
+import helpers.metrics
+import helpers.pagination
+import helpers.pe
+import helpers.sources
+import helpers.workers
+from helpers.logs import log_context
+from helpers.loopmonitor import LoopLagMonitor
+from helpers.notifier import NotificationQueue
+from helpers.realms import load_realms
+from helpers.retention import RetentionManager
+from helpers.scrubber import Scrubber
 
 # Initialize the logger
 logger = logging.getLogger(__name__)
@@ -17,267 +37,593 @@ version = "1.0"
 extensions = ["cogs.admincommands", "cogs.membercommands"]
 
 
-async def fetch_patch():
+@contextlib.contextmanager
+def pipeline_stage(stage):
+    # Time a stage for the metrics endpoint and tag the log records made during it
+    with helpers.metrics.STAGE_SECONDS.time(stage=stage), log_context(stage=stage):
+        yield
+
+
+async def fetch_patch(realm):
     try:
-        reader, writer = await asyncio.open_connection("patch.pathofexile.com", 12995)
-        writer.write(bytes([1, 6]))
-        await writer.drain()
-        data = await reader.read(1024)
-        writer.close()
-        await writer.wait_closed()
-        patch = data[35 : 35 + data[34] * 2].decode("utf-16le").split("/")[-2]
-        logger.debug(f"Fetched patch version directly: {patch}")
-        return patch
+        response = await realm.patch_server_client.fetch()
+        logger.debug(
+            "[%s] Fetched patch version directly: %s (CDNs: %s)",
+            realm.name,
+            response.version,
+            response.cdn_urls,
+        )
+        return response.version
     except Exception as e:
-        logger.error(f"An error occurred while fetching patch: {e}")
+        logger.error("An error occurred while fetching patch: %s", e)
         return None
 
 
-async def fetch_patch_from_github():
-    url = "https://raw.githubusercontent.com/poe-tool-dev/latest-patch-version/main/latest.txt"
+github_fetcher = helpers.http.ConditionalFetcher()
+
+
+async def fetch_patch_from_github(session, url):
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                version = await response.text()
-                version = version.strip()
-                logger.debug(f"Fetched patch version from GitHub: {version}")
-                return version
+        version = await github_fetcher.get_text(session, url)
+        version = version.strip()
+        logger.debug("Fetched patch version from GitHub (%s): %s", url, version)
+        return version
     except Exception as e:
-        logger.error(f"An error occurred while fetching patch from GitHub: {e}")
+        logger.error("An error occurred while fetching patch from GitHub: %s", e)
         return None
 
 
+async def fetch_latest_version(bot, realm):
+    fetchers = {
+        "direct": lambda: fetch_patch(realm),
+        "github": lambda: fetch_patch_from_github(bot.http_session, realm.github_url),
+    }
+    sources = {name: fetchers[name] for name in realm.sources}
+
+    async def is_new(version):
+        return not await db.fetchone(
+            "SELECT 1 FROM patch WHERE realm=? AND version=?", (realm.name, version)
+        )
+
+    with pipeline_stage("poll"):
+        result = await helpers.sources.resolve_version(
+            sources,
+            require_agreement=settings.REQUIRE_SOURCE_AGREEMENT,
+            timeout=settings.VERSION_SOURCE_TIMEOUT,
+            is_new=is_new,
+        )
+    if logger.isEnabledFor(logging.DEBUG):
+        latencies = ", ".join(
+            f"{name}={latency * 1000:.0f}ms" for name, latency in result.latencies.items()
+        )
+        logger.debug(
+            "[%s] Resolved version %s from %s (%s)",
+            realm.name,
+            result.version,
+            result.source,
+            latencies,
+        )
+    return result
+
+
 intents = discord.Intents.all()
 
 
-async def patch_downloader():
-    logger.info("Started Patch Downloader Task.")
-    while True:
+async def download_artifact(bot, realm, version, name):
+    # Download, hash and archive one file of a version; returns None if the CDN does not have it
+    exe_url = f"{realm.cdn_base_url}/{version}/{name}"
+    logger.debug("Exe URL: %s", exe_url)
+
+    # Each realm downloads into its own directory so partial downloads never collide
+    exe_path = realm.download_directory / name
+    downloader = helpers.download.RangedDownloader(
+        bot.http_session,
+        segment_size=settings.DOWNLOAD_SEGMENT_SIZE,
+        connections=settings.DOWNLOAD_CONNECTIONS,
+        retries=settings.DOWNLOAD_RETRIES,
+        limiter=bot.bandwidth_limiter,
+    )
+    async with bot.artifact_semaphore:
         try:
-            version = (
-                await fetch_patch()
-                if settings.FETCH_DIRECTLY
-                else await fetch_patch_from_github()
+            # Partial progress is kept on disk and resumed on the next poll
+            with pipeline_stage("download"):
+                downloaded = await downloader.download(exe_url, exe_path)
+        except aiohttp.ClientResponseError as e:
+            log = logger.error if name == realm.artifacts[0] else logger.info
+            log("[%s] Failed to download %s. Status code: %s", realm.name, name, e.status)
+            return None
+
+        if downloaded is None:
+            return None
+
+        exe_hash, exe_size = downloaded
+        logger.debug("%s Hash: %s (%s bytes)", name, exe_hash, exe_size)
+        helpers.metrics.DOWNLOADED_BYTES.inc(exe_size, realm=realm.name)
+        with pipeline_stage("pe_analysis"):
+            pe_info = await helpers.pe.analyze_exe(exe_path)
+
+        # Dedup on the blob table: a file without a row was left by an attempt that failed
+        # before committing, and still needs its row written with this version
+        orphan = None
+        if await db.fetchone("SELECT 1 FROM blob WHERE exe_hash = ?", (exe_hash,)):
+            logger.info("%s %s is identical to a stored exe, reusing its archive.", name, version)
+            stored = None
+        elif (orphan := blobs.find(exe_hash)) and orphan[1] == "full":
+            path, kind, codec = orphan
+            logger.info("Reusing the archive of %s %s left by an earlier attempt.", name, version)
+            stored = kind, None, 0, path.stat().st_size, codec
+        else:
+            if orphan:
+                # The delta base of an earlier attempt is unknown; diff again
+                orphan[0].unlink()
+            with pipeline_stage("archive"):
+                stored = await store_exe(exe_path, exe_hash, exe_size, name, realm.name)
+            if stored is None:
+                exe_path.unlink()
+                raise ValueError(f"Archive of {name} for version {version} failed verification")
+            logger.debug("Stored %s %s as %s blob (%s bytes).", name, version, stored[0], stored[3])
+            helpers.metrics.STORED_BYTES.inc(stored[3], kind=stored[0])
+
+        # Clean up the leftover .exe file
+        exe_path.unlink()
+        return exe_hash, exe_size, stored, pe_info
+
+
+async def download_version(bot, realm, version):
+    # The first artifact is required; the others are skipped if this version does not ship them
+    results = await asyncio.gather(
+        *(download_artifact(bot, realm, version, name) for name in realm.artifacts),
+        return_exceptions=True,
+    )
+    for name, result in zip(realm.artifacts, results):
+        if isinstance(result, BaseException):
+            logger.error(
+                "[%s] Failed to store %s for version %s: %s", realm.name, name, version, result
             )
-            if version and version.lower() != "none":
-                settings.CURSOR.execute(
-                    "SELECT * FROM patch WHERE version=?", (version,)
+            return False
+    if results[0] is None:
+        return False
+
+    current_unix_time = int(datetime.datetime.now().timestamp())
+    statements = []
+    for name, result in zip(realm.artifacts, results):
+        if result is None:
+            logger.info("Version %s has no %s, skipping it.", version, name)
+            continue
+        exe_hash, exe_size, stored, pe_info = result
+        if stored:
+            kind, base_hash, chain_length, size, codec = stored
+            statements.append(
+                (
+                    "INSERT OR IGNORE INTO blob (exe_hash, size, unix_time, kind, base_hash, chain_length, codec) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (exe_hash, size, current_unix_time, kind, base_hash, chain_length, codec),
                 )
-                result = settings.CURSOR.fetchone()
+            )
+        statements.append(
+            (
+                "INSERT INTO artifact (realm, version, name, exe_hash, size, unix_time) VALUES (?, ?, ?, ?, ?, ?)",
+                (realm.name, version, name, exe_hash, exe_size, current_unix_time),
+            )
+        )
+        if pe_info:
+            statements += helpers.pe.insert_statements(exe_hash, pe_info, current_unix_time)
+
+    statements += [
+        (
+            "INSERT INTO patch (realm, version, exe_hash, unix_time) VALUES (?, ?, ?, ?)",
+            (realm.name, version, results[0][0], current_unix_time),
+        ),
+        (
+            "INSERT INTO message_log (realm, version, sent, unix_time_sent, unix_time_logged) VALUES (?, ?, ?, ?, ?)",
+            (realm.name, version, False, None, current_unix_time),
+        ),
+    ]
+
+    # Insert data into SQLite with Unix timestamps
+    with pipeline_stage("db_commit"):
+        message_id = (await db.transaction(statements))[-1]
+
+    helpers.lookup.record(version, [result[0] for result in results if result])
+    helpers.pagination.page_cache.invalidate()
+
+    # Hand the version straight to the notifier
+    bot.notifications.put(message_id, realm.name, version, current_unix_time)
+
+    logger.info("[%s] New version %s downloaded, stored, and cleaned up.", realm.name, version)
+    return True
+
+
+async def patch_downloader(bot, realm):
+    logger.info("Started Patch Downloader Task for realm '%s'.", realm.name)
+    scheduler = realm.scheduler
+    last_version = None
+    while True:
+        version = None
+        try:
+            resolved = await fetch_latest_version(bot, realm)
+            version = resolved.version
+            if version:
+                result = await db.fetchone(
+                    "SELECT * FROM patch WHERE realm=? AND version=?", (realm.name, version)
+                )
+                # Only source failures back off. The burst starts when a new version is first
+                # seen, so a download that fails is retried at the fast interval while it lasts.
+                scheduler.record_success(changed=not result and version != last_version)
+                last_version = version
 
                 if not result:
-                    exe_url = f"https://patch.poecdn.com/{version}/PathOfExile.exe"
-                    zip_name = f"{version}.zip"
-                    logger.debug(f"Exe URL: {exe_url}")
-                    logger.debug(f"Zip Name: {zip_name}")
-
-                    if not (settings.DOWNLOAD_DIRECTORY / zip_name).exists():
-                        async with aiohttp.ClientSession() as session:
-                            async with session.get(exe_url) as response:
-                                if response.status != 200:
-                                    logger.error(
-                                        f"Failed to download executable. Status code: {response.status}"
-                                    )
-                                    continue
-                                exe_path = (
-                                    settings.DOWNLOAD_DIRECTORY / "PathOfExile.exe"
-                                )
-                                with exe_path.open("wb") as f:
-                                    f.write(await response.read())
-
-                        if exe_path.stat().st_size < 3 * 1024 * 1024:
-                            logger.info(
-                                f"Raw file `{exe_path}` is smaller than 3MB. Skipping download."
-                            )
-                            exe_path.unlink()
-                            continue
-
-                        hash_object = hashlib.sha256()
-                        with exe_path.open("rb") as f:
-                            hash_object.update(f.read())
-                        exe_hash = hash_object.hexdigest()
-                        logger.debug(f"Exe Hash: {exe_hash}")
-
-                        zip_path = settings.DOWNLOAD_DIRECTORY / zip_name
-                        with ZipFile(
-                            zip_path, "w", ZIP_DEFLATED, compresslevel=9
-                        ) as zipf:
-                            zipf.write(exe_path, arcname="PathOfExile.exe")
-
-                        # Insert data into SQLite with Unix timestamps
-                        current_unix_time = int(datetime.datetime.now().timestamp())
-                        settings.CURSOR.execute(
-                            "INSERT INTO patch (version, exe_hash, unix_time) VALUES (?, ?, ?)",
-                            (version, exe_hash, current_unix_time),
-                        )
-                        settings.CURSOR.execute(
-                            "INSERT INTO message_log (version, sent, unix_time_sent, unix_time_logged) VALUES (?, ?, ?, ?)",
-                            (version, False, None, current_unix_time),
-                        )
-                        settings.CONN.commit()
-
-                        # Move the ZIP file to the storage directory
-                        storage_zip_path = settings.STORAGE_DIRECTORY / zip_name
-                        zip_path.replace(storage_zip_path)
-
-                        # Clean up the leftover .exe file
-                        exe_path.unlink()
-
-                        logger.info(
-                            f"New version {version} downloaded, stored, and cleaned up."
-                        )
-                    else:
-                        logger.info(f"ZIP file for version {version} already exists.")
+                    with log_context(realm=realm.name, version=version):
+                        downloaded = await download_version(bot, realm, version)
+                    helpers.metrics.POLLS.inc(
+                        realm=realm.name, result="changed" if downloaded else "failed"
+                    )
+                else:
+                    helpers.metrics.POLLS.inc(realm=realm.name, result="unchanged")
+            elif resolved.disagreed:
+                # Usually a patch rolling out; the sources answered, so keep polling at pace
+                logger.warning(
+                    "[%s] Version sources do not agree yet: %s", realm.name, resolved.answers
+                )
+                scheduler.record_success(changed=False)
+                helpers.metrics.POLLS.inc(realm=realm.name, result="no_agreement")
             else:
-                logger.error(f"Invalid or no version found: {version}")
+                logger.error("[%s] Invalid or no version found: %s", realm.name, version)
+                scheduler.record_failure()
+                helpers.metrics.POLLS.inc(realm=realm.name, result="failed")
         except Exception as e:
-            logger.error(f"Error in patch downloader: {e}")
-
-        logger.debug(f"Patch Downloader waiting {settings.TIME_INTERVAL_TO_DOWNLOAD}s.")
-        await asyncio.sleep(settings.TIME_INTERVAL_TO_DOWNLOAD)
-
-
-async def send_pending_messages(bot):
-    logger.info("Started Pending Message Task.")
-    while True:
-        if bot.is_ready():
-            logger.debug("Bot is ready. Checking for pending messages...")
-
-            # Fetch pending messages
-            settings.CURSOR.execute("SELECT * FROM message_log WHERE sent=0")
-            pending_messages = settings.CURSOR.fetchall()
-            logger.debug(f"Found {len(pending_messages)} pending messages.")
+            logger.error("[%s] Error in patch downloader: %s", realm.name, e)
+            if not version:
+                scheduler.record_failure()
+            helpers.metrics.POLLS.inc(realm=realm.name, result="failed")
+
+        delay = scheduler.next_delay()
+        logger.debug(
+            "[%s] Patch Downloader waiting %.1fs (interval %.1fs).",
+            realm.name,
+            delay,
+            scheduler.current_interval,
+        )
+        await asyncio.sleep(delay)
+
+
+async def analyze_legacy_exe(exe_hash, version):
+    # Versions stored before the blob store only exist as STORAGE_DIRECTORY/{version}.zip
+    legacy_path = settings.STORAGE_DIRECTORY / f"{version}.zip"
+    exe_path = settings.DOWNLOAD_DIRECTORY / f"{exe_hash}.exe"
+    try:
+        exe_path.parent.mkdir(parents=True, exist_ok=True)
+        await helpers.workers.run_in_worker(helpers.workers.extract_zip, legacy_path, exe_path)
+        return await helpers.pe.analyze_exe(exe_path)
+    except (OSError, zipfile.BadZipFile) as e:
+        logger.warning("Could not extract %s from %s for analysis: %s", exe_hash, legacy_path, e)
+        return None
+    finally:
+        exe_path.unlink(missing_ok=True)
+
+
+async def analyze_archived_exes():
+    # Parse the PE headers of exes archived before the analysis stage existed, one at a time
+    missing = await db.fetchall(
+        "SELECT artifact.exe_hash, MIN(artifact.version) FROM artifact "
+        "LEFT JOIN pe_image ON pe_image.exe_hash = artifact.exe_hash "
+        "WHERE pe_image.exe_hash IS NULL GROUP BY artifact.exe_hash"
+    )
+    if missing:
+        logger.info("Analyzing PE headers of %s archived exes.", len(missing))
+    for exe_hash, version in missing:
+        if not blobs.exists(exe_hash):
+            pe_info = await analyze_legacy_exe(exe_hash, version)
+        else:
+            with cache.pin(exe_hash):
+                try:
+                    exe_path = await materialize(exe_hash)
+                except (LookupError, ValueError, OSError) as e:
+                    logger.warning("Could not rebuild %s for analysis: %s", exe_hash, e)
+                    continue
+                pe_info = await helpers.pe.analyze_exe(exe_path)
+        if pe_info:
+            current_unix_time = int(datetime.datetime.now().timestamp())
+            await db.transaction(
+                helpers.pe.insert_statements(exe_hash, pe_info, current_unix_time)
+            )
+    if missing:
+        logger.info("Finished analyzing archived exes.")
+
+
+async def enqueue_pending_messages(bot):
+    # Pick up rows that were never sent: left over from a previous run or failed earlier
+    pending_messages = await db.fetchall(
+        "SELECT id, realm, version, unix_time_logged FROM message_log WHERE sent=0"
+    )
+    logger.debug("Found %s pending messages.", len(pending_messages))
+    for message_id, realm, version, unix_time_logged in pending_messages:
+        if realm not in bot.realms:
+            logger.warning(
+                "Message %s belongs to unconfigured realm '%s', skipping it.", message_id, realm
+            )
+            continue
+        bot.notifications.put(message_id, realm, version, unix_time_logged)
+
+
+async def send_notification(bot, notification):
+    realm = bot.realms[notification.realm]
+    version = notification.version
+    logger.debug(
+        "[%s] Processing message for version %s with id %s.",
+        realm.name,
+        version,
+        notification.message_id,
+    )
+    started = time.time()
+    bot.notifications.record_stage("queued", started - notification.queued_at)
 
-            for message in pending_messages:
-                version = message[1]
-                storage_zip_path = settings.STORAGE_DIRECTORY / f"{version}.zip"
-                logger.debug(
-                    f"Processing message for version {version} with id {message[0]}."
+    try:
+        # Fetch the artifacts and any earlier upload of the same exes from the database
+        artifacts = await db.fetchall(
+            "SELECT artifact.name, artifact.exe_hash, blob.upload_message_url FROM artifact "
+            "LEFT JOIN blob ON blob.exe_hash = artifact.exe_hash "
+            "WHERE artifact.realm=? AND artifact.version=? ORDER BY artifact.id",
+            (realm.name, version),
+        )
+        if not artifacts:
+            raise LookupError(f"No artifacts recorded for version {version}")
+
+        links = {}
+        to_upload = []
+        for name, exe_hash, upload_message_url in artifacts:
+            if upload_message_url:
+                # Identical binary was uploaded before; link to it instead of uploading again
+                links[name] = f"[{name} (unchanged exe)]({upload_message_url})"
+                logger.debug("Reusing upload %s for %s %s.", upload_message_url, name, version)
+            elif await bot.scrubber.is_flagged(exe_hash):
+                # Announce without it rather than retry forever; integrity_report shows why
+                links[name] = f"{name} (archive quarantined, failed its integrity check)"
+                logger.warning(
+                    "Archive of %s %s failed its integrity check, not uploading it.", name, version
                 )
+            else:
+                to_upload.append((name, exe_hash))
 
-                try:
-                    with storage_zip_path.open("rb") as fp:
-                        logger.debug(f"Uploading file for version {version}...")
-                        file_upload = await bot.get_channel(settings.CHANNEL_ID).send(
-                            file=discord.File(fp, filename=f"{version}.zip")
-                        )
-                        attachment_url = file_upload.attachments[0].url
-                        logger.debug(
-                            f"File uploaded for version {version}. Attachment URL: {attachment_url}"
-                        )
-
-                        # Fetch exe_hash from the database
-                        settings.CURSOR.execute(
-                            "SELECT exe_hash FROM patch WHERE version=?", (version,)
+        # Discord allows 10 attachments per message
+        for start in range(0, len(to_upload), 10):
+            batch = to_upload[start : start + 10]
+            files = []
+            try:
+                for name, exe_hash in batch:
+                    # discord.File opens the archive, so only the lookup needs the pin
+                    with cache.pin(exe_hash, ".zip"):
+                        storage_zip_path, extension = await archive_path(version, exe_hash, name)
+                        filename = (
+                            f"{version}{extension}"
+                            if name == artifacts[0][0]
+                            else f"{version}-{pathlib.Path(name).stem}{extension}"
                         )
-                        exe_hash = settings.CURSOR.fetchone()
-                        exe_hash = exe_hash[0] if exe_hash else "N/A(uh oh)"
+                        files.append(discord.File(storage_zip_path, filename=filename))
+
+                logger.debug("Uploading %s files for version %s...", len(files), version)
+                file_upload = await bot.get_channel(realm.channel_id).send(files=files)
+            finally:
+                # A failed lookup or send would otherwise leak the handles on every retry
+                for f in files:
+                    f.close()
+            for (name, exe_hash), attachment in zip(batch, file_upload.attachments):
+                links[name] = f"[{name}]({attachment.url})"
+                logger.debug(
+                    "File uploaded for %s %s. Attachment URL: %s", name, version, attachment.url
+                )
+                await db.execute(
+                    "INSERT INTO blob (exe_hash, upload_message_url, attachment_url) VALUES (?, ?, ?) "
+                    "ON CONFLICT (exe_hash) DO UPDATE SET "
+                    "upload_message_url = excluded.upload_message_url, attachment_url = excluded.attachment_url",
+                    (exe_hash, file_upload.jump_url, attachment.url),
+                )
+        uploaded = time.time()
+        bot.notifications.record_stage("upload", uploaded - started)
 
-                        embed = discord.Embed(
-                            color=discord.Color(0x4DEFF2),
-                            title="PathOfExile.exe Version Change Detected",
-                            url="https://www.pathofexile.com/forum/view-forum/patch-notes",
-                        )
-                        embed.add_field(
-                            name="Version:", value=f"`{version}`", inline=True
-                        )
-                        embed.add_field(
-                            name="Zip:",
-                            value=f"[PathOfExile.exe]({attachment_url})",
-                            inline=True,
-                        )
-                        embed.add_field(
-                            name="When:",
-                            value=f"<t:{int(datetime.datetime.now().timestamp())}:R>",
-                            inline=True,
-                        )
-                        embed.add_field(
-                            name="Exe Hash:", value=f"`{exe_hash}`", inline=False
-                        )
+        zip_link = "\n".join(links[name] for name, _, _ in artifacts)
+        if len(artifacts) == 1:
+            exe_hash = f"`{artifacts[0][1]}`"
+        else:
+            exe_hash = "\n".join(f"{name}: `{exe_hash}`" for name, exe_hash, _ in artifacts)
+
+        embed = discord.Embed(
+            color=discord.Color(0x4DEFF2),
+            title=f"{realm.title} Version Change Detected",
+            url="https://www.pathofexile.com/forum/view-forum/patch-notes",
+        )
+        embed.add_field(name="Version:", value=f"`{version}`", inline=True)
+        embed.add_field(
+            name="Zip:",
+            value=zip_link,
+            inline=True,
+        )
+        embed.add_field(
+            name="When:",
+            value=f"<t:{int(datetime.datetime.now().timestamp())}:R>",
+            inline=True,
+        )
+        embed.add_field(name="Exe Hash:", value=exe_hash, inline=False)
+
+        if settings.MEGA_LINK_ENABLED:
+            embed.add_field(
+                name="Binaries:",
+                value=f"[*MEGA link to all.*]({settings.MEGA_LINK})",
+                inline=False,
+            )
 
-                        if settings.MEGA_LINK_ENABLED:
-                            embed.add_field(
-                                name="Binaries:",
-                                value=f"[*MEGA link to all.*]({settings.MEGA_LINK})",
-                                inline=False,
-                            )
-                            
-                        embed.add_field(
-                            name="*Source:*",
-                            value="*[PR's for this project can be done so here, I'm not watching them.](https://github.com/DetectiveSquirrel/PathOfExilePatchCollection)*",
-                            inline=False,
-                        )
+        embed.add_field(
+            name="*Source:*",
+            value="*[PR's for this project can be done so here, I'm not watching them.](https://github.com/DetectiveSquirrel/PathOfExilePatchCollection)*",
+            inline=False,
+        )
+
+        message_content = f"<@&{realm.notification_role}> {realm.title} {version}"
+        logger.debug("Sending message to notifier channel for version %s...", version)
+        await bot.get_channel(realm.channel_notifier_id).send(
+            message_content, embed=embed
+        )
+        bot.notifications.record_stage("announce", time.time() - uploaded)
+        logger.info("Message sent to notifier channel for version %s.", version)
+
+        # Update the message log entry to mark it as sent
+        logger.debug("Updating database for message id %s...", notification.message_id)
+        current_unix_time = int(datetime.datetime.now().timestamp())
+        await db.execute(
+            "UPDATE message_log SET sent = ?, unix_time_sent = ? WHERE id = ?",
+            (True, current_unix_time, notification.message_id),
+        )
+        bot.notifications.record_stage(
+            "logged_to_sent", current_unix_time - notification.logged_at
+        )
+        helpers.metrics.DETECTION_TO_ANNOUNCE_SECONDS.observe(
+            current_unix_time - notification.logged_at
+        )
+        logger.debug(
+            "Database updated for message id %s: marked as sent.", notification.message_id
+        )
+        return True
+    except Exception as e:
+        logger.error(
+            "Failed to send message for version %s: %s. Will retry in %ss.",
+            version,
+            e,
+            settings.TIME_INTERVAL_TO_MESSAGE,
+        )
+        return False
 
-                        message_content = f"<@&{settings.NOTIFICATION_ROLE}> PathOfExile.exe {version}"
-                        logger.debug(
-                            f"Sending message to notifier channel for version {version}..."
-                        )
-                        await bot.get_channel(settings.CHANNEL_NOTIFIER_ID).send(
-                            message_content, embed=embed
-                        )
-                        logger.info(
-                            f"Message sent to notifier channel for version {version}."
-                        )
 
-                        # Update the message log entry to mark it as sent
-                        logger.debug(
-                            f"Updating database for message id {message[0]}..."
-                        )
-                        settings.CURSOR.execute(
-                            "UPDATE message_log SET sent = ?, unix_time_sent = ? WHERE id = ?",
-                            (
-                                True,
-                                int(datetime.datetime.now().timestamp()),
-                                message[0],
-                            ),
-                        )
-                        settings.CONN.commit()
-                        logger.debug(
-                            f"Database updated for message id {message[0]}: marked as sent."
-                        )
-                except Exception as e:
-                    logger.error(
-                        f"Failed to send message for version {version}: {e}. Continuing to the next message..."
-                    )
+async def send_pending_messages(bot):
+    logger.info("Started Pending Message Task.")
+    await bot.wait_until_ready()
+    await enqueue_pending_messages(bot)
 
-        else:
-            logger.debug("Bot is not ready.")
+    retry_pending = False
+    while True:
+        try:
+            # Only wake up on a timer when there is a failed message to retry
+            notification = await bot.notifications.get(
+                settings.TIME_INTERVAL_TO_MESSAGE if retry_pending else None
+            )
+        except asyncio.TimeoutError:
+            retry_pending = False
+            await enqueue_pending_messages(bot)
+            continue
 
-        logger.debug(f"Pending Message waiting {settings.TIME_INTERVAL_TO_MESSAGE}s.")
-        await asyncio.sleep(settings.TIME_INTERVAL_TO_MESSAGE)
+        await bot.wait_until_ready()
+        with log_context(realm=notification.realm, version=notification.version):
+            sent = await send_notification(bot, notification)
+        bot.notifications.done(notification, sent)
+        retry_pending = retry_pending or not sent
 
 
 class MyBot(commands.Bot):
     def __init__(self, *args, **kwargs):
         # Startup message
-        logger.info(f"Starting up bot '{name} v{version}'")
+        logger.info("Starting up bot '%s v%s'", name, version)
         super().__init__(*args, **kwargs)
+        self.loop_lag_monitor = LoopLagMonitor(
+            warn_threshold=settings.EVENT_LOOP_LAG_WARNING
+        )
+        self.notifications = NotificationQueue()
+        # Shared by every realm's downloads
+        self.artifact_semaphore = asyncio.Semaphore(settings.ARTIFACT_CONCURRENCY)
+        self.bandwidth_limiter = helpers.download.BandwidthLimiter(
+            settings.DOWNLOAD_BANDWIDTH_LIMIT
+        )
+        self.realms = load_realms()
+        self.retention = RetentionManager(
+            blobs,
+            budget=settings.RETENTION_HOT_BUDGET,
+            keep_hot=settings.RETENTION_KEEP_HOT,
+            cold_codec=(
+                get_codec(
+                    settings.RETENTION_COLD_CODEC,
+                    settings.RETENTION_COLD_CODEC_LEVEL,
+                    settings.ARCHIVE_CODEC_THREADS,
+                )
+                if settings.RETENTION_COLD_CODEC
+                else None
+            ),
+            io_rate=settings.RETENTION_IO_RATE,
+        )
+        self.scrubber = Scrubber(io_rate=settings.SCRUB_IO_RATE, interval=settings.SCRUB_INTERVAL)
+        # Created in setup_hook; close() can run before that if startup fails
+        self.http_session = None
+        self.metrics_server = helpers.metrics.MetricsServer(
+            settings.METRICS_HOST, settings.METRICS_PORT
+        )
+        helpers.metrics.LOOP_LAG_SECONDS.set_function(lambda: self.loop_lag_monitor.last_lag)
+        helpers.metrics.LOOP_LAG_MAX_SECONDS.set_function(lambda: self.loop_lag_monitor.max_lag)
+        helpers.metrics.QUEUE_DEPTH.set_function(lambda: self.notifications.pending_count)
+        helpers.metrics.OLDEST_PENDING_SECONDS.set_function(self.notifications.oldest_pending_age)
 
     async def setup_hook(self):
-        self.loop.create_task(patch_downloader())
+        # Open the database and apply pending migrations before any task touches it
+        db.start()
+        await helpers.lookup.load()
+        # Extensions and commands are set up once per process, not on every (re)connect
+        await self.load_extensions()
+        self.tree.copy_global_to(guild=settings.BASE_SERVER)
+        try:
+            await helpers.commandsync.sync_if_changed(
+                self.tree, settings.BASE_SERVER, settings.COMMAND_TREE_HASH_PATH
+            )
+        except discord.HTTPException as e:
+            logger.error("Failed to sync the command tree: %s", e)
+        self.http_session = helpers.http.create_session()
+        self.loop.create_task(self.loop_lag_monitor.run())
+        if settings.METRICS_ENABLED:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                # Metrics are optional; a taken port must not keep the bot from starting
+                logger.error(
+                    "Failed to start the metrics server on %s:%s: %s",
+                    settings.METRICS_HOST,
+                    settings.METRICS_PORT,
+                    e,
+                )
+        for realm in self.realms.values():
+            self.loop.create_task(patch_downloader(self, realm))
         self.loop.create_task(send_pending_messages(self))
-
-    async def on_ready(self):
-        logger.info(f"{self.user.name} has connected to Discord!")
-
+        self.loop.create_task(analyze_archived_exes())
+        if settings.RETENTION_HOT_BUDGET:
+            self.loop.create_task(self.retention.run(settings.RETENTION_INTERVAL))
+        if settings.SCRUB_ENABLED:
+            self.loop.create_task(self.scrubber.run())
+
+    async def close(self):
+        await super().close()
+        if self.http_session is not None:
+            await self.http_session.close()
+        for realm in self.realms.values():
+            await realm.patch_server_client.close()
+        self.scrubber.close()
+        await self.metrics_server.close()
+        db.close()
+        helpers.workers.shutdown_executor()
+
+    async def load_extensions(self):
         for extension in extensions:
             try:
                 await self.load_extension(extension)
-                logger.info(f"Loaded extension '{extension}'")
+                logger.info("Loaded extension '%s'", extension)
             except commands.ExtensionAlreadyLoaded:
-                logger.warning(f"Extension '{extension}' is already loaded")
+                logger.warning("Extension '%s' is already loaded", extension)
             except commands.ExtensionNotFound:
-                logger.error(f"Extension '{extension}' not found")
+                logger.error("Extension '%s' not found", extension)
             except commands.NoEntryPointError:
-                logger.error(f"Extension '{extension}' does not have a setup function")
+                logger.error("Extension '%s' does not have a setup function", extension)
             except commands.ExtensionFailed as e:
-                logger.error(f"Extension '{extension}' failed to load: {e}")
+                logger.error("Extension '%s' failed to load: %s", extension, e)
 
-        self.tree.copy_global_to(guild=settings.BASE_SERVER_ID)
-        await self.tree.sync(guild=settings.BASE_SERVER_ID)
+    async def on_ready(self):
+        # Fires again after every reconnect, so it must stay cheap
+        logger.info("%s has connected to Discord!", self.user.name)
 
 
 async def main():
+    settings.configure_logging()
     async with MyBot(command_prefix="!", intents=intents) as bot:
         await bot.start(settings.DISCORD_API_SECRET, reconnect=True)
 
@@ -1,112 +1,334 @@
 import pathlib
 import os
-import discord
-from logging.config import dictConfig
-from dotenv import load_dotenv
-import sqlite3
+import threading
+from dataclasses import dataclass, field, fields, MISSING
+
+# Importing this module has no side effects. The configuration is read from the
+# environment (and .env) on first access, e.g. `settings.ARCHIVE_MODE`, and validated
+# once; logging is configured by configure_logging() and the database opens on first use.
 
-# Ensure the logs directory exists before configuring logging
 BASE_DIR = pathlib.Path(__file__).parent
 LOGS_DIR = BASE_DIR / "logs"
-LOGS_DIR.mkdir(exist_ok=True)
 DATA_DIR = BASE_DIR / "data"
 
-# Parse env
-load_dotenv()
-
-# Bot Token
-DISCORD_API_SECRET = os.getenv("DISCORD_API_SECRET")
-
-#Mega Config
-MEGA_LINK_ENABLED = os.getenv("MEGA_LINK_ENABLED", "false").lower() == "true"
-MEGA_LINK = os.getenv("MEGA_LINK", "https://google.com")
-
-# Base Config
-BASE_SERVER_ID = discord.Object(id=int(os.getenv("BASE_SERVER_ID", 0)))
-BASE_OWNER_ID = int(os.getenv("BASE_OWNER_ID", 0))
-All_COMMANDS_REQUIRED_ROLE_ID = int(os.getenv("All_COMMANDS_REQUIRED_ROLE_ID", 0))
-CHANNEL_ID = int(os.getenv("CHANNEL_ID", 0))
-CHANNEL_NOTIFIER_ID = int(os.getenv("CHANNEL_NOTIFIER_ID", 0))
-NOTIFICATION_ROLE = int(os.getenv("NOTIFICATION_ROLE", 0))
-TIME_INTERVAL_TO_DOWNLOAD = int(os.getenv("TIME_INTERVAL_TO_DOWNLOAD", 60))
-TIME_INTERVAL_TO_MESSAGE = int(os.getenv("TIME_INTERVAL_TO_MESSAGE", 10))
-TIME_INTERVAL = int(os.getenv("TIME_INTERVAL", 60))
-BASE_DIRECTORY = os.getenv("BASE_DIRECTORY", "data")
-FETCH_DIRECTLY = os.getenv("FETCH_DIRECTLY", "false").lower() == "true"
-LOG_ONLY_NEW_VERSIONS = os.getenv("LOG_ONLY_NEW_VERSIONS", "true").lower() == "true"
-
-# Path settings
-BASE_PATH = pathlib.Path(BASE_DIRECTORY).absolute()
-STORAGE_DIRECTORY = BASE_PATH / "stored"
-DOWNLOAD_DIRECTORY = BASE_PATH / "download"
-STORAGE_DIRECTORY.mkdir(parents=True, exist_ok=True)
-DOWNLOAD_DIRECTORY.mkdir(parents=True, exist_ok=True)
-
-# SQLite settings
-DATABASE_PATH = BASE_PATH / "patchdatabase_v2.db"
-CONN = sqlite3.connect(DATABASE_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
-CURSOR = CONN.cursor()
-
-# Create tables if not exist
-CURSOR.execute(
-    """CREATE TABLE IF NOT EXISTS patch (
-             version TEXT,
-             exe_hash TEXT,
-             unix_time INTEGER)"""
-)
-
-CURSOR.execute(
-    """CREATE TABLE IF NOT EXISTS message_log (
-             id INTEGER PRIMARY KEY AUTOINCREMENT,
-             version TEXT,
-             sent BOOLEAN,
-             unix_time_sent INTEGER,
-             unix_time_logged INTEGER)"""
-)
-
-# Logging Configuration
-LOGGING_CONFIG = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {
-        "normal": {
-            "format": "%(levelname)-10s - %(asctime)s - %(module)-15s : %(message)s"
-        },
-    },
-    "handlers": {
-        "console": {
-            "level": "DEBUG",
-            "class": "logging.StreamHandler",
-            "formatter": "normal",
-        },
-        "file": {
-            "level": "DEBUG",
-            "class": "logging.handlers.RotatingFileHandler",
-            "filename": "logs/infos.log",
-            "mode": "a",
-            "formatter": "normal",
-            "maxBytes": 50 * 1024 * 1024,  # 50 MB
-            "backupCount": 5,
-        },
-    },
-    "loggers": {
-        "bot": {"handlers": ["file"], "level": "INFO", "propagate": True},
-        "discord": {
-            "handlers": ["file", "console"],
-            "level": "INFO",
-            "propagate": True,
+
+class ConfigError(ValueError):
+    pass
+
+
+def setting(
+    default=MISSING, *, factory=MISSING, choices=None, minimum=None, maximum=None, aliases=()
+):
+    # A field read from the environment variable of the same name
+    metadata = {"choices": choices, "minimum": minimum, "maximum": maximum, "aliases": aliases}
+    return field(default=default, default_factory=factory, metadata=metadata)
+
+
+def _parse(name, kind, raw):
+    if kind is bool:
+        value = raw.strip().lower()
+        if value in ("true", "1", "yes"):
+            return True
+        if value in ("false", "0", "no", ""):
+            return False
+        raise ConfigError(f"{name} must be true or false, got {raw!r}")
+    if kind is list:
+        return [item.strip() for item in raw.split(",") if item.strip()]
+    if kind is pathlib.Path:
+        return pathlib.Path(raw).absolute()
+    try:
+        return kind(raw)
+    except ValueError:
+        raise ConfigError(f"{name} must be {kind.__name__}, got {raw!r}") from None
+
+
+@dataclass
+class Config:
+    # Bot Token
+    DISCORD_API_SECRET: str = setting(None)
+
+    # Mega Config
+    MEGA_LINK_ENABLED: bool = setting(False)
+    MEGA_LINK: str = setting("https://google.com")
+
+    # Base Config
+    BASE_SERVER_ID: int = setting(0)
+    BASE_OWNER_ID: int = setting(0)
+    ALL_COMMANDS_REQUIRED_ROLE_ID: int = setting(0, aliases=("All_COMMANDS_REQUIRED_ROLE_ID",))
+    CHANNEL_ID: int = setting(0)
+    CHANNEL_NOTIFIER_ID: int = setting(0)
+    NOTIFICATION_ROLE: int = setting(0)
+    TIME_INTERVAL_TO_DOWNLOAD: int = setting(60, minimum=1)
+    TIME_INTERVAL_TO_MESSAGE: int = setting(10, minimum=1)
+    TIME_INTERVAL: int = setting(60, minimum=1)
+    # Adaptive polling: TIME_INTERVAL_TO_DOWNLOAD is the idle interval
+    POLL_FAST_INTERVAL: float = setting(10.0, minimum=1)
+    POLL_MAX_INTERVAL: float = setting(600.0, minimum=1)
+    POLL_BURST_DURATION: float = setting(1800.0, minimum=0)
+    POLL_JITTER: float = setting(0.1, minimum=0)
+    # Comma separated UTC windows polled at the fast interval, e.g. "Tue 19:00-23:00,Fri 18:00-22:00"
+    POLL_HOT_WINDOWS: str = setting("")
+    BASE_DIRECTORY: str = setting("data")
+    # Version sources raced on every poll: "direct" (patch server) and/or "github"
+    VERSION_SOURCES: list = setting(factory=lambda: ["direct", "github"])
+    # Number of sources that must report the same version before it is downloaded
+    REQUIRE_SOURCE_AGREEMENT: int = setting(1, minimum=1)
+    VERSION_SOURCE_TIMEOUT: float = setting(15.0, minimum=1)
+    LOG_ONLY_NEW_VERSIONS: bool = setting(True)
+
+    # Worker pool for hashing, compressing and verifying ("thread" or "process")
+    WORKER_POOL_TYPE: str = setting("thread", choices=("thread", "process"))
+    WORKER_POOL_SIZE: int = setting(2, minimum=1)
+    EVENT_LOOP_LAG_WARNING: float = setting(1.0, minimum=0)
+
+    # "text" or "json"; json writes one object per line with realm, version and stage fields
+    LOG_FORMAT: str = setting("text", choices=("text", "json"))
+
+    # Prometheus metrics endpoint, served on http://METRICS_HOST:METRICS_PORT/metrics
+    METRICS_ENABLED: bool = setting(True)
+    METRICS_HOST: str = setting("127.0.0.1")
+    METRICS_PORT: int = setting(9108, minimum=1, maximum=65535)
+
+    # Patch server (patch.pathofexile.com protocol)
+    PATCH_SERVER_HOST: str = setting("patch.pathofexile.com")
+    PATCH_SERVER_PORT: int = setting(12995, minimum=1, maximum=65535)
+    PATCH_SERVER_CONNECT_TIMEOUT: float = setting(5.0, minimum=0)
+    PATCH_SERVER_READ_TIMEOUT: float = setting(5.0, minimum=0)
+
+    # Files fetched from the CDN for every version; the first one is required
+    CDN_BASE_URL: str = setting("https://patch.poecdn.com")
+    ARTIFACTS: list = setting(factory=lambda: ["PathOfExile.exe"])
+    ARTIFACT_CONCURRENCY: int = setting(2, minimum=1)
+
+    # Ranged CDN downloads
+    DOWNLOAD_SEGMENT_SIZE: int = setting(8 * 1024 * 1024, minimum=1)
+    DOWNLOAD_CONNECTIONS: int = setting(4, minimum=1)
+    DOWNLOAD_RETRIES: int = setting(3, minimum=0)
+    # Combined limit for every download in bytes per second, 0 for unlimited
+    DOWNLOAD_BANDWIDTH_LIMIT: int = setting(0, minimum=0)
+
+    # JSON list of realms to track; empty tracks one realm built from the settings above
+    REALMS_FILE: str = setting("")
+
+    # Shared HTTP client
+    HTTP_POOL_SIZE: int = setting(10, minimum=1)
+    HTTP_DNS_CACHE_TTL: int = setting(300, minimum=0)
+    HTTP_KEEPALIVE_TIMEOUT: float = setting(120.0, minimum=0)
+    HTTP_CONNECT_TIMEOUT: float = setting(10.0, minimum=0)
+    HTTP_READ_TIMEOUT: float = setting(30.0, minimum=0)
+
+    # Codec for full archives: "deflate" (zip), "zstd" (needs zstandard) or "xz"
+    ARCHIVE_CODEC: str = setting("deflate", choices=("deflate", "zstd", "xz"))
+    ARCHIVE_CODEC_LEVEL: int = setting(None)
+    # 0 uses every CPU core for zstd and up to 4 for xz (about 670 MB each at level 9)
+    ARCHIVE_CODEC_THREADS: int = setting(0, minimum=0)
+
+    # Archive storage: "full" archives every exe, "delta" stores binary diffs between keyframes
+    ARCHIVE_MODE: str = setting("full", choices=("full", "delta"))
+    DELTA_KEYFRAME_INTERVAL: int = setting(10, minimum=1)
+    # Store a keyframe instead when the delta is larger than this fraction of the exe
+    DELTA_MAX_RATIO: float = setting(0.5, minimum=0)
+    DELTA_CACHE_SIZE: int = setting(4, minimum=1)
+
+    # Retention: keep the hot tier under a byte budget by moving older archives to the cold tier
+    RETENTION_HOT_BUDGET: int = setting(0, minimum=0)  # bytes, 0 disables retention
+    # Newest versions per realm that always stay hot
+    RETENTION_KEEP_HOT: int = setting(10, minimum=0)
+    # Defaults to STORAGE_DIRECTORY/cold
+    COLD_STORAGE_DIRECTORY: pathlib.Path = setting(None)
+    # Recompress full archives with this codec when they go cold; empty keeps their codec
+    RETENTION_COLD_CODEC: str = setting("", choices=("", "deflate", "zstd", "xz"))
+    RETENTION_COLD_CODEC_LEVEL: int = setting(None)
+    # Average disk throughput allowed for the retention task in bytes per second
+    RETENTION_IO_RATE: int = setting(20 * 1024 * 1024, minimum=0)
+    RETENTION_INTERVAL: int = setting(3600, minimum=1)
+
+    # Integrity scrubber: re-hash every stored exe once per interval, throttled to SCRUB_IO_RATE
+    SCRUB_ENABLED: bool = setting(True)
+    SCRUB_INTERVAL: int = setting(7 * 24 * 3600, minimum=1)
+    SCRUB_IO_RATE: int = setting(10 * 1024 * 1024, minimum=0)  # bytes per second
+
+    # SQLite settings
+    DATABASE_READERS: int = setting(2, minimum=1)
+
+    # Paths derived from BASE_DIRECTORY; directories are created by whatever writes to them
+    BASE_PATH: pathlib.Path = field(init=False)
+    STORAGE_DIRECTORY: pathlib.Path = field(init=False)
+    DOWNLOAD_DIRECTORY: pathlib.Path = field(init=False)
+    DATABASE_PATH: pathlib.Path = field(init=False)
+    # Hash of the last synced slash command tree; delete it to force a sync
+    COMMAND_TREE_HASH_PATH: pathlib.Path = field(init=False)
+
+    def __post_init__(self):
+        self.CDN_BASE_URL = self.CDN_BASE_URL.rstrip("/")
+        self.BASE_PATH = pathlib.Path(self.BASE_DIRECTORY).absolute()
+        self.STORAGE_DIRECTORY = self.BASE_PATH / "stored"
+        self.DOWNLOAD_DIRECTORY = self.BASE_PATH / "download"
+        self.DATABASE_PATH = self.BASE_PATH / "patchdatabase_v2.db"
+        self.COMMAND_TREE_HASH_PATH = self.BASE_PATH / "command_tree.sha256"
+        if self.COLD_STORAGE_DIRECTORY is None:
+            self.COLD_STORAGE_DIRECTORY = self.STORAGE_DIRECTORY / "cold"
+        self._validate()
+
+    def _validate(self):
+        # Checks that span several settings or need a parser; each names the variable at fault
+        from helpers.codecs import CODECS
+        from helpers.scheduler import parse_hot_windows
+        from helpers.sources import SOURCES
+
+        if not self.VERSION_SOURCES:
+            raise ConfigError("VERSION_SOURCES must name at least one source")
+        unknown = [name for name in self.VERSION_SOURCES if name not in SOURCES]
+        if unknown:
+            raise ConfigError(f"VERSION_SOURCES has unknown sources {unknown}, expected {list(SOURCES)}")
+        # Realms from REALMS_FILE list their own sources and are checked when loaded
+        if not self.REALMS_FILE and self.REQUIRE_SOURCE_AGREEMENT > len(self.VERSION_SOURCES):
+            raise ConfigError(
+                f"REQUIRE_SOURCE_AGREEMENT is {self.REQUIRE_SOURCE_AGREEMENT}, "
+                f"but VERSION_SOURCES has only {len(self.VERSION_SOURCES)} sources"
+            )
+
+        for name, codec, level in (
+            ("ARCHIVE_CODEC_LEVEL", self.ARCHIVE_CODEC, self.ARCHIVE_CODEC_LEVEL),
+            ("RETENTION_COLD_CODEC_LEVEL", self.RETENTION_COLD_CODEC, self.RETENTION_COLD_CODEC_LEVEL),
+        ):
+            levels = CODECS[codec].levels if codec else None
+            if level is not None and levels is not None and level not in levels:
+                raise ConfigError(
+                    f"{name} must be between {levels.start} and {levels.stop - 1} for {codec}, got {level}"
+                )
+
+        try:
+            parse_hot_windows(self.POLL_HOT_WINDOWS)
+        except ValueError as e:
+            raise ConfigError(f"POLL_HOT_WINDOWS: {e}") from None
+
+    @property
+    def BASE_SERVER(self):
+        # discord.Object for the base guild; discord is only imported when this is used
+        import discord
+
+        return discord.Object(id=self.BASE_SERVER_ID)
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        values = {}
+        for setting_field in fields(cls):
+            if not setting_field.init:
+                continue
+            names = (setting_field.name, *setting_field.metadata["aliases"])
+            raw = next((environ[name] for name in names if name in environ), None)
+            if raw is None or (raw == "" and setting_field.type not in (str, list, bool)):
+                continue
+            value = _parse(setting_field.name, setting_field.type, raw)
+            choices = setting_field.metadata["choices"]
+            if choices is not None:
+                value = value.lower()
+                if value not in choices:
+                    raise ConfigError(f"{setting_field.name} must be one of {choices}, got {raw!r}")
+            minimum = setting_field.metadata["minimum"]
+            if minimum is not None and value < minimum:
+                raise ConfigError(f"{setting_field.name} must be at least {minimum}, got {raw!r}")
+            maximum = setting_field.metadata["maximum"]
+            if maximum is not None and value > maximum:
+                raise ConfigError(f"{setting_field.name} must be at most {maximum}, got {raw!r}")
+            values[setting_field.name] = value
+        # FETCH_DIRECTLY predates VERSION_SOURCES: true polled the patch server, false GitHub
+        if "VERSION_SOURCES" not in values and environ.get("FETCH_DIRECTLY"):
+            fetch_directly = _parse("FETCH_DIRECTLY", bool, environ["FETCH_DIRECTLY"])
+            values["VERSION_SOURCES"] = ["direct"] if fetch_directly else ["github"]
+        return cls(**values)
+
+
+_config = None
+_config_lock = threading.Lock()
+_logging_configured = False
+
+
+def get_config() -> Config:
+    # Parse and validate the environment once; later calls return the same object
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                from dotenv import load_dotenv
+
+                load_dotenv()
+                _config = Config.from_env()
+    return _config
+
+
+def __getattr__(name):
+    # Module attribute access (`settings.ARCHIVE_MODE`) reads the config object
+    if name.startswith("__"):
+        raise AttributeError(name)
+    return getattr(get_config(), name)
+
+
+def logging_config(config: Config):
+    formatter = "json" if config.LOG_FORMAT == "json" else "normal"
+    return {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": {
+            "normal": {
+                "format": "%(levelname)-10s - %(asctime)s - %(module)-15s : %(message)s"
+            },
+            "json": {"()": "helpers.logs.JsonFormatter"},
         },
-        "__main__": {
-            "handlers": ["file", "console"],
-            "level": "INFO",
-            "propagate": True,
+        "handlers": {
+            "console": {
+                "level": "DEBUG",
+                "class": "logging.StreamHandler",
+                "formatter": formatter,
+            },
+            "file": {
+                "level": "DEBUG",
+                "class": "logging.handlers.RotatingFileHandler",
+                "filename": str(LOGS_DIR / "infos.log"),
+                "mode": "a",
+                "formatter": formatter,
+                "maxBytes": 50 * 1024 * 1024,  # 50 MB
+                "backupCount": 5,
+            },
         },
-        "command-use": {
-            "handlers": ["file", "console"],
-            "level": "INFO",
-            "propagate": True,
+        "loggers": {
+            "bot": {"handlers": ["file"], "level": "INFO", "propagate": True},
+            "discord": {
+                "handlers": ["file", "console"],
+                "level": "INFO",
+                "propagate": True,
+            },
+            "__main__": {
+                "handlers": ["file", "console"],
+                "level": "INFO",
+                "propagate": True,
+            },
+            "helpers": {
+                "handlers": ["file", "console"],
+                "level": "INFO",
+                "propagate": True,
+            },
+            "command-use": {
+                "handlers": ["file", "console"],
+                "level": "INFO",
+                "propagate": True,
+            },
         },
-    },
-}
+    }
+
+
+def configure_logging():
+    # Called once by the entry point; tools and tests that import modules skip it
+    global _logging_configured
+    if _logging_configured:
+        return
+    from logging.config import dictConfig
+    import helpers.logs
 
-dictConfig(LOGGING_CONFIG)
+    config = logging_config(get_config())
+    LOGS_DIR.mkdir(exist_ok=True)
+    dictConfig(config)
+    # Formatting and file I/O happen on a listener thread, off the event loop
+    helpers.logs.use_queue(config["loggers"])
+    _logging_configured = True
@@ -4,6 +4,7 @@ import sqlite3
 import datetime
 import pytz
 import shutil
+import helpers.migrations
 
 # Ensure the logs directory exists before configuring logging
 BASE_DIR = pathlib.Path(__file__).parent
@@ -39,25 +40,17 @@ if migration_needed:
     CONN_V1 = sqlite3.connect(OLD_DATABASE_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
     CURSOR_V1 = CONN_V1.cursor()
 
-CONN_V2 = sqlite3.connect(NEW_DATABASE_PATH)
+CONN_V2 = sqlite3.connect(NEW_DATABASE_PATH, isolation_level=None)
 CURSOR_V2 = CONN_V2.cursor()
 
-# Create new tables in the new database
-CURSOR_V2.execute(
-    """CREATE TABLE IF NOT EXISTS patch (
-             version TEXT,
-             exe_hash TEXT,
-             unix_time INTEGER)"""
-)
-
-CURSOR_V2.execute(
-    """CREATE TABLE IF NOT EXISTS message_log (
-             id INTEGER PRIMARY KEY AUTOINCREMENT,
-             version TEXT,
-             sent BOOLEAN,
-             unix_time_sent INTEGER,
-             unix_time_logged INTEGER)"""
-)
+# Create the base tables; the remaining migrations run after the data is copied
+# so duplicates from the old database are cleaned up before the indexes are built
+if helpers.migrations.schema_version(CONN_V2) == 0:
+    CURSOR_V2.execute("BEGIN")
+    for statement in helpers.migrations.MIGRATIONS[0][2]:
+        CURSOR_V2.execute(statement)
+    CURSOR_V2.execute("PRAGMA user_version = 1")
+    CURSOR_V2.execute("COMMIT")
 
 # Function to convert date-time strings to Unix timestamps
 def convert_to_unix(date_time_str):
@@ -80,33 +73,38 @@ def convert_to_unix(date_time_str):
 
 # Migrate data from the old database to the new one
 def migrate_data():
+    CURSOR_V2.execute("BEGIN")
+
     # Migrate patch table
     CURSOR_V1.execute("SELECT version, exe_hash, date_time FROM patch")
-    patches = CURSOR_V1.fetchall()
-    for version, exe_hash, date_time in patches:
-        unix_time = convert_to_unix(date_time)
-        CURSOR_V2.execute(
-            "INSERT INTO patch (version, exe_hash, unix_time) VALUES (?, ?, ?)",
-            (version, exe_hash, unix_time),
-        )
+    CURSOR_V2.executemany(
+        "INSERT OR IGNORE INTO patch (version, exe_hash, unix_time) VALUES (?, ?, ?)",
+        (
+            (version, exe_hash, convert_to_unix(date_time))
+            for version, exe_hash, date_time in CURSOR_V1
+        ),
+    )
 
     # Migrate message_log table
     CURSOR_V1.execute(
         "SELECT id, version, sent, timestamp_sent, timestamp_logged FROM message_log"
     )
-    messages = CURSOR_V1.fetchall()
-    for message_id, version, sent, timestamp_sent, timestamp_logged in messages:
-        unix_time_sent = convert_to_unix(timestamp_sent) if timestamp_sent else None
-        unix_time_logged = (
-            convert_to_unix(timestamp_logged) if timestamp_logged else None
-        )
-        CURSOR_V2.execute(
-            "INSERT INTO message_log (id, version, sent, unix_time_sent, unix_time_logged) VALUES (?, ?, ?, ?, ?)",
-            (message_id, version, sent, unix_time_sent, unix_time_logged),
-        )
+    CURSOR_V2.executemany(
+        "INSERT INTO message_log (id, version, sent, unix_time_sent, unix_time_logged) VALUES (?, ?, ?, ?, ?)",
+        (
+            (
+                message_id,
+                version,
+                sent,
+                convert_to_unix(timestamp_sent) if timestamp_sent else None,
+                convert_to_unix(timestamp_logged) if timestamp_logged else None,
+            )
+            for message_id, version, sent, timestamp_sent, timestamp_logged in CURSOR_V1
+        ),
+    )
 
     # Commit the changes
-    CONN_V2.commit()
+    CURSOR_V2.execute("COMMIT")
 
 
 # Perform the migration if needed
@@ -115,6 +113,9 @@ if migration_needed:
     # Close the old database connection
     CONN_V1.close()
 
+# Bring the new database up to the current schema
+helpers.migrations.migrate(CONN_V2)
+
 # Close the new database connection
 CONN_V2.close()
 